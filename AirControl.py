@@ -1,6 +1,23 @@
+import os
 import serial
 import time
+import fcntl
+import tempfile
 import subprocess
+import threading
+import collections
+import traceback
+from Station import station_name
+from Configuration import configuration
+
+# by-id name of the Arduino reading the box sensor and switching the air relay; each station sets its own under
+# Stations (see Station.py)
+defaultboard = 'usb-FTDI_FT232R_USB_UART_AC0090JP-if00-port'
+
+# A GUI which turned the air on keeps a file in this directory (one per Arduino) holding its pid, and the air is only
+# turned off once no running GUI holds it. Station.py gives each station its own Arduino, so this only matters when
+# GUIs started by hand share one.
+airholders = os.path.join(tempfile.gettempdir(), 'hgcal-dry-air')
 
 class AirControl:
 
@@ -8,35 +25,80 @@ class AirControl:
 
         # automatic discovery of serial address location by device ID
         usblines = subprocess.getoutput("ls -l /dev/serial/by-id").split('\n')
-        thisboard = 'usb-FTDI_FT232R_USB_UART_AC0090JP-if00-port'
+        thisboard = configuration['AirControlSerialID'] if 'AirControlSerialID' in configuration.keys() else defaultboard
 
+        self.ttystr = None
         for line in usblines:
             if thisboard in line:
                 thisusb = line.split(' ')[-1].split('/')[-1]
                 self.ttystr = '/dev/'+thisusb
                 print('  >> AirControl: using', self.ttystr)
+        if self.ttystr is None:
+            raise RuntimeError(f'RH sensor {thisboard} not found in /dev/serial/by-id')
 
         self.nano = serial.Serial(self.ttystr, 115200, timeout=2)
         # Change port if needed, default /dev/ttyUSB1 # port changed on 07/25/2024, #lsusb; dmesg | grep tty
         # As of 2024/8/26 trying both ports as they seem to change without warning
         # As of 2024/10/4, switched to automatic discovery
 
+        self.holder = station_name() if station_name() is not None else 'main'
+        self.holders = os.path.join(airholders, thisboard)
+        os.makedirs(self.holders, exist_ok=True)
+
     def __del__(self):
         self.nano.close()
 
+    def _holders(self):
+        """Returns the stations holding the air on, dropping those whose process has exited. Call with the lock held
+        """
+        holders = []
+        for name in os.listdir(self.holders):
+            if name.startswith('.'):
+                continue
+            path = os.path.join(self.holders, name)
+            try:
+                with open(path, 'r') as file:
+                    os.kill(int(file.read().strip()), 0)
+            except PermissionError:
+                pass # running as another user
+            except (ValueError, ProcessLookupError, FileNotFoundError):
+                if os.path.exists(path):
+                    os.remove(path)
+                continue
+            holders.append(name)
+        return holders
+
+    def _locked(self):
+        """Returns the open lock file of the air holders, locked; closing it releases the lock
+        """
+        lock = open(os.path.join(self.holders, '.lock'), 'w')
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        return lock
+
     def set_air_on(self):
-        """Turns the air relay on
+        """Turns the air relay on and marks this station as holding it
         """
-        self.nano.write(b'air on\n')
-        self.nano.write(b'air on\n')
+        with self._locked():
+            with open(os.path.join(self.holders, self.holder), 'w') as file:
+                file.write(str(os.getpid()))
+            self.nano.write(b'air on\n')
+            self.nano.write(b'air on\n')
         print('  >> AirControl: air on')
 
     def set_air_off(self):
-        """Turns the air relay off
+        """Releases this station's hold on the air, and turns the air relay off if no other station holds it
         """
-        self.nano.write(b'air off\n')
-        self.nano.write(b'air off\n')
-        print('  >> AirControl: air off')
+        with self._locked():
+            if os.path.exists(os.path.join(self.holders, self.holder)):
+                os.remove(os.path.join(self.holders, self.holder))
+            others = self._holders()
+            if len(others) == 0:
+                self.nano.write(b'air off\n')
+                self.nano.write(b'air off\n')
+        if len(others) == 0:
+            print('  >> AirControl: air off')
+        else:
+            print('  >> AirControl: air left on for station', ', '.join(others))
 
     def get_humidity(self):
         """Returns the current humidity as an integer percentage
@@ -52,6 +114,97 @@ class AirControl:
         temperature_string = environment_string.split(',')[1]
         return int(temperature_string)
         
+class EnvironmentSampler:
+    """
+    Reads every line the sensor sends in a background thread and keeps the RH and temperature in a ring buffer of
+    (timestamp, RH, T) samples, so both values always come from the same line and readers never wait on the serial
+    port. Owns the one AirControl object used by the GUI; use get_sampler() rather than creating one directly.
+    While the sampler runs, nothing else should read from the controller.
+    """
+
+    def __init__(self, controller=None, size=4*3600):
+
+        self.controller = AirControl() if controller is None else controller
+        self.samples = collections.deque(maxlen=size)
+        self.errors = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+
+        while not self._stop.is_set():
+            try:
+                line = self.controller.nano.readline().decode('ASCII').rstrip()
+                if line == '':
+                    continue # serial timeout
+                humidity_string, temperature_string = line.split(',')[0:2]
+                sample = (time.time(), int(humidity_string), int(temperature_string))
+            except (ValueError, UnicodeDecodeError):
+                self.errors += 1 # partial or garbled line
+                continue
+            except serial.SerialException:
+                print('  -- AirControl: sampler exception:', traceback.format_exc())
+                self.errors += 1
+                time.sleep(1)
+                continue
+            with self._lock:
+                self.samples.append(sample)
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def latest(self, wait=5.):
+        """Returns the most recent (RH, T), waiting up to wait seconds for a first sample. Returns (None, None) if there is none
+        """
+        deadline = time.time() + wait
+        while len(self.samples) == 0 and time.time() < deadline:
+            time.sleep(0.1)
+        with self._lock:
+            if len(self.samples) == 0:
+                return None, None
+            return self.samples[-1][1], self.samples[-1][2]
+
+    def average(self, seconds=60.):
+        """Returns the mean (RH, T) over the last seconds, or (None, None) if there are no samples in that window
+        """
+        recent = self.series(since=time.time() - seconds)
+        if len(recent) == 0:
+            return None, None
+        return sum([s[1] for s in recent])/len(recent), sum([s[2] for s in recent])/len(recent)
+
+    def series(self, since=None):
+        """Returns the list of (timestamp, RH, T) samples taken after since (all buffered samples if None)
+        """
+        with self._lock:
+            return [sample for sample in self.samples if since is None or sample[0] > since]
+
+    def save(self, path, since=None):
+        """Writes the samples taken after since to a csv file and returns the number written
+        """
+        samples = self.series(since)
+        with open(path, 'w') as file:
+            file.write('timestamp,RH,Temp\n')
+            for timestamp, RH, Temp in samples:
+                file.write(f'{round(timestamp, 2)},{RH},{Temp}\n')
+        return len(samples)
+
+_sampler = None
+_sampler_lock = threading.Lock()
+
+def get_sampler():
+    """
+    Returns the shared EnvironmentSampler, starting it (and opening the serial port) the first time it is called.
+    """
+
+    global _sampler
+    with _sampler_lock:
+        if _sampler is None:
+            _sampler = EnvironmentSampler()
+        return _sampler
+
 if __name__ == "__main__":
     controller = AirControl()
     while True:
@@ -0,0 +1,21 @@
+import yaml
+from Station import station_configuration
+
+"""
+-------------------Configuration.py-----------------
+
+Loads configuration.yaml (see writeconfig.py) once per process, with the values of the current station applied (see
+Station.py). Every other module uses this one dictionary:
+
+    from Configuration import configuration
+-----------------------------------------------------
+"""
+
+configuration = {}
+with open('configuration.yaml', 'r') as file:
+    configuration = station_configuration(yaml.safe_load(file))
+
+# for configuration files written before 'FPGAHostname' and 'FPGAType' replaced 'TrenzHostname'
+if 'FPGAHostname' not in configuration.keys() or 'FPGAType' not in configuration.keys():
+    configuration['FPGAHostname'] = configuration['TrenzHostname']
+    configuration['FPGAType'] = ['Trenz' for k in configuration['TrenzHostname']]
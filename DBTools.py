@@ -1,6 +1,4 @@
-import PySimpleGUI as sg
 import numpy as np
-import traceback
 import time
 import matplotlib.pyplot as plt
 import pickle
@@ -18,10 +16,7 @@ from hexmap.plot_summary import get_pad_id
 from hexmap.plot_summary import create_masks
 from functools import reduce
 
-import yaml
-configuration = {}
-with open('configuration.yaml', 'r') as file:
-    configuration = yaml.safe_load(file)
+from Configuration import configuration
 
 # different versions of uproot for each OS =.=
 if configuration['TestingPCOpSys'] == 'Centos7':
@@ -39,10 +34,11 @@ def iv_save(datadict, state):
 
     moduleserial = state['-Module-Serial-']
     outdir = state['-Output-Subdir-']
-    with open(f'{configuration["DataLoc"]}/{outdir}/{moduleserial}_IVset_{datadict["date"]}_{datadict["time"]}_{datadict["RH"]}.pkl', 'wb') as datafile:
+    path = f'{configuration["DataLoc"]}/{outdir}/{moduleserial}_IVset_{datadict["date"]}_{datadict["time"]}_{datadict["RH"]}.pkl'
+    with open(path, 'wb') as datafile:
         pickle.dump(datadict, datafile)
 
-    return f'{configuration["DataLoc"]}/{outdir}/{moduleserial}_IVset_{datadict["date"]}_{datadict["time"]}_{datadict["RH"]}_{datadict["Temp"]}.pkl'
+    return path
         
 def read_table(tablename, printall=False):
     """
@@ -691,7 +687,7 @@ def summary_upload(moduleserial, qc_summary):
     
 def add_RH_T(state, force=False):
     """
-    Adds RH, T inside box to the state dictionary as integers. Uses AirControl class which was implemented for CMU and is not
+    Adds RH, T inside box to the state dictionary as integers. Uses the AirControl sampler which was implemented for CMU and is not
     general to all MACs. Automatic sensing is disabled by "HasRHSensor: false" in the configuration file.
     """
     
@@ -700,45 +696,26 @@ def add_RH_T(state, force=False):
     
     if ('-Box-RH-' not in state.keys() or '-Box-T-' not in state.keys()) or force: # only add once per testing session, except if you really need
 
-        # if no automatic RH sensor, enter manually
-        if not configuration['HasRHSensor'] or state['-Debug-Mode-']: 
-
-            layout = [[sg.Text('Enter current humidity and temperature:', font=('Arial', 30))],
-                      [sg.Input(s=3, key='-RH-'), sg.Text("% RH"), sg.Input(s=4, key='-Temp-'), sg.Text(" deg C")], [sg.Button('Enter')]]
-            window = sg.Window(f"Module Test: Enter RH and Temp", layout, margins=(200,100))
-        
-            while True:
-                event, values = window.read()
-                if event == 'Enter' or event == sg.WIN_CLOSED:
-                    RH = values['-RH-'].rstrip()
-                    Temp = values['-Temp-'].rstrip()
-                if RH is None or Temp is None:
-                    continue
-                else:
+        # latest sample from the background sampler, so RH and T come from the same reading
+        if configuration['HasRHSensor'] and not state['-Debug-Mode-']:
+            from AirControl import get_sampler
+            for i in range(3):
+                RH, Temp = get_sampler().latest(wait=20.)
+                if RH is not None and Temp is not None:
+                    print(f'  >> RH/T: measured RH={RH}%; T={Temp}ºC')
                     break
-
-            window.close()
-
-        # if automatic RH sensor, query for RH and T
+                print(f'  -- RH/T: no reading from the sensor (attempt {i})')
+
+        # if no automatic RH sensor, or it gave no reading, ask the operator
+        for i in range(5):
+            try:
+                state['-Box-RH-'] = int(RH)
+                state['-Box-T-'] = int(Temp)
+                break
+            except (TypeError, ValueError):
+                RH, Temp = state['operator'].ask_RH_T()
         else:
-            from AirControl import AirControl
-            for i in range(10):
-                controller = AirControl()
-                try:
-                    RH = controller.get_humidity()
-                    Temp = controller.get_temperature()
-                    break
-                except Exception:
-                    print('  -- RH/T exception:', traceback.format_exc())
-                    print(f'  -- Trying again (attempt {i})')
-
-            print(f'  >> RH/T: measured RH={RH}%; T={Temp}ºC')
-
-        try:
-            state['-Box-RH-'] = int(RH)
-            state['-Box-T-'] = int(Temp)
-        except ValueError:
-            add_RH_T(state, force)
+            raise ValueError(f'no valid RH/T given (RH={RH}, T={Temp})')
         
         return RH, Temp
 
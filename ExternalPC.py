@@ -1,20 +1,26 @@
-import paramiko
 import time
 import os
 import subprocess
 import sys
 import glob
+import json
+import select
+import signal
+import re
+import shutil
+import tempfile
+import threading
+import logging
+import logging.handlers
 from time import sleep
+from datetime import datetime
 import traceback
 
 import yaml
-configuration = {}
-with open('configuration.yaml', 'r') as file:
-    configuration = yaml.safe_load(file)
+from Configuration import configuration
+from Timing import span
 
 sys.path.insert(1, './hexmap')
-from plot_summary import make_hexmap_plots_from_file
-import plot_summary
 
 class ExternalPC: # no longer Centos7
     """
@@ -35,8 +41,10 @@ class ExternalPC: # no longer Centos7
         self.live = state['-Live-Module-']
         
         self.initiated = False
+        # each station of a multi-station PC runs its own DAQ client service
+        self.daqclient = configuration['DAQClientService'] if 'DAQClientService' in configuration.keys() else 'daq-client'
         # start the DAQ client
-        os.system('systemctl restart daq-client.service')
+        os.system(f'systemctl restart {self.daqclient}.service')
         print(' >> ExternalPC: DAQ client started. PC ready to run tests.')
 
         # in Centos7 or Alma9 branch ROCv3, stick to main path of environment and scripts
@@ -114,14 +122,24 @@ class ExternalPC: # no longer Centos7
                     raise NotImplementedError
 
         # copy to current directory to update it safely while trimming
-        os.system(f'cp {self.config} current_config.yaml')
-        print(f' >> ExternalPC: copying {self.config} to current directory as current_config.yaml')
-        self.config = 'current_config.yaml'
+        current = 'current_config.yaml' if configuration['StationName'] is None else f"current_config_{configuration['StationName']}.yaml"
+        os.system(f'cp {self.config} {current}')
+        print(f' >> ExternalPC: copying {self.config} to current directory as {current}')
+        self.config = current
 
         self.outyaml = {'pedestal_scan': 'trimmed_pedestal.yaml', 'sampling_scan': 'best_phase.yaml',
                         'vrefinv_scan': 'vrefinv.yaml', 'vrefnoinv_scan': 'vrefnoinv.yaml',
                         'toa_vref_scan_noinj': 'toa_vref.yaml', 'toa_vref_scan': 'toa_vref.yaml',
                         'toa_trim_scan': 'trimmed_toa.yaml'}
+
+        # optionally keep one process in the hexactrl environment for the whole session to launch scripts from
+        self.worker = None
+        if 'HexactrlWorker' in configuration.keys() and configuration['HexactrlWorker']:
+            try:
+                self.worker = HexactrlWorker(self.env, self.scriptloc)
+            except RuntimeError:
+                print(' -- ExternalPC: hexactrl worker did not start, launching scripts with bash instead')
+                self.worker = None
         
     def init_outdir(self, outdir):
         self.outdir = outdir
@@ -134,11 +152,11 @@ class ExternalPC: # no longer Centos7
         Restarts DAQ client service by running a bash command, then checks the status and returns it.
         """
 
-        print(' >> ExternalPC: systemctl restart daq-client.service')
-        os.system('systemctl restart daq-client.service')
+        print(f' >> ExternalPC: systemctl restart {self.daqclient}.service')
+        os.system(f'systemctl restart {self.daqclient}.service')
         sleep(1)
-        print(' >> ExternalPC: systemctl status daq-client')
-        stdout = os.popen('systemctl status daq-client').read().split('\n')
+        print(f' >> ExternalPC: systemctl status {self.daqclient}')
+        stdout = os.popen(f'systemctl status {self.daqclient}').read().split('\n')
         client = False
         for line in stdout:
             if 'Active: active (running)' in line:
@@ -155,8 +173,8 @@ class ExternalPC: # no longer Centos7
         Checks the status of the DAQ client and returns it.
         """
 
-        print(' >> ExternalPC: systemctl status daq-client')
-        stdout = os.popen('systemctl status daq-client').read().split('\n')
+        print(f' >> ExternalPC: systemctl status {self.daqclient}')
+        stdout = os.popen(f'systemctl status {self.daqclient}').read().split('\n')
         client = False
         for line in stdout:
             if 'Active: active (running)' in line:
@@ -167,6 +185,46 @@ class ExternalPC: # no longer Centos7
             print(' -- ExternalPC: Error in DAQ client')
         return client
 
+    def close(self):
+        """
+        Stops the hexactrl worker, if there is one. Called at the end of the session.
+        """
+
+        if self.worker is not None:
+            self.worker.close()
+            self.worker = None
+
+    def _script_args(self, config):
+        """
+        Returns the command line arguments passed to every testing script. Adds -I if the ROCs have not been initialized yet.
+        """
+
+        args = ['-i', self.trenzhostname, '-f', config, '-o', f'{configuration["DataLoc"]}/{self.basedir}/', '-d', self.dut]
+        if not self.initiated:
+            args.append('-I')
+        return args
+
+    def _launch(self, scriptname, config=None, output=os.devnull):
+        """
+        Starts a testing script without waiting for it and returns a handle with the poll(), wait(), and terminate()
+        methods of subprocess.Popen. The script runs in the hexactrl worker if there is one, otherwise in a new bash
+        shell that sources the environment first. The script's stdout and stderr go to output.
+        """
+
+        if config is None:
+            config = self.config
+
+        script = self.scriptloc + scriptname + '.py'
+        args = self._script_args(config)
+
+        if self.worker is not None and self.worker.alive():
+            return self.worker.submit(script, args, output)
+
+        # exec so that terminating the process stops the script itself rather than just the shell
+        command = f'source {self.env} && exec python3 {script} ' + ' '.join(args)
+        with open(output, 'a') as out:
+            return subprocess.Popen(command, shell=True, executable="/bin/bash", stdout=out, stderr=subprocess.STDOUT)
+
     def _run_script(self, scriptname, config=None):
         """
         Runs a testing script after setting up the environment. Inputs are the name of the script without the location or the .py and optionally
@@ -177,7 +235,8 @@ class ExternalPC: # no longer Centos7
         testing script call - if false, it will run with -I and then set the flag to true. You can always manually set 
         the flag from outside the class if you want it to run -I at any given time.
 
-        The environment script is run every time because os.system deletes the shell after the call is over.
+        The environment script is run every time because os.system deletes the shell after the call is over, unless the
+        hexactrl worker is enabled, in which case the script is forked from the already set up worker.
 
         If the script run produces an output configuration file, this function uses it to modify the original configuration file with its values.
         """
@@ -185,14 +244,7 @@ class ExternalPC: # no longer Centos7
         if config is None:
             config = self.config
         
-        script = self.scriptloc + scriptname + '.py'
-
-        print(f' >> ExternalPC: Running {scriptname}.py with config {config}...')
-
-        if not self.initiated:
-            os.system(f'source {self.env} && python3 {script} -i {self.trenzhostname} -f {config} -o {configuration["DataLoc"]}/{self.basedir}/ -d {self.dut} -I > /dev/null 2>&1')
-        else:
-            os.system(f'source {self.env} && python3 {script} -i {self.trenzhostname} -f {config} -o {configuration["DataLoc"]}/{self.basedir}/ -d {self.dut} > /dev/null 2>&1')
+        ScriptProcess(scriptname, self, config=config).wait()
         runs = glob.glob(f'{configuration["DataLoc"]}/{self.outdir}/{scriptname}/*')
             
         runs.sort()
@@ -212,15 +264,8 @@ class ExternalPC: # no longer Centos7
         return runs[-1]
 
     def create_proc(self, scriptname):
-            
-        script = self.scriptloc + scriptname + '.py'
 
-        if not self.initiated:
-            command = f'source {self.env} && python3 {script} -i {self.trenzhostname} -f {self.config} -o {configuration["DataLoc"]}/{self.basedir}/ -d {self.dut} -I > /dev/null 2>&1'
-        else:
-            command = f'source {self.env} && python3 {script} -i {self.trenzhostname} -f {self.config} -o {configuration["DataLoc"]}/{self.basedir}/ -d {self.dut} > /dev/null 2>&1'
-
-        proc = ScriptProcess(scriptname, command, self)
+        proc = ScriptProcess(scriptname, self)
         return proc
 
     def pedestal_proc(self, BV=None):
@@ -271,7 +316,9 @@ class ExternalPC: # no longer Centos7
         labelind = ind if ind != -1 else len(runs)-1
         label = f'{self.modulename}_run{labelind}' if tag is None else f'{self.modulename}_run{labelind}_{tag}'
 
-        make_hexmap_plots_from_file(f'{runs[ind]}/pedestal_run0.root', figdir=f'{configuration["DataLoc"]}/{self.outdir}/', label=label)
+        from plot_summary import make_hexmap_plots_from_file # pandas and matplotlib, only once plots are made
+        with span('hexmap', label=label):
+            make_hexmap_plots_from_file(f'{runs[ind]}/pedestal_run0.root', figdir=f'{configuration["DataLoc"]}/{self.outdir}/', label=label)
         print(f' >> Hexmap: Summary plots located in {configuration["DataLoc"]}/{self.outdir} as {label}')
 
         return f'{configuration["DataLoc"]}/{self.outdir}/{label}'
@@ -288,7 +335,9 @@ def static_make_hexmaps(modulename, ind=-1, tag=None):
     labelind = ind if ind != -1 else len(runs)-1
     label = f'{modulename}_run{labelind}' if tag is None else f'{modulename}_run{labelind}_{tag}'
 
-    make_hexmap_plots_from_file(f'{runs[ind]}/pedestal_run0.root', figdir=f'{configuration["DataLoc"]}/{modulename}', label=label)
+    from plot_summary import make_hexmap_plots_from_file
+    with span('hexmap', label=label):
+        make_hexmap_plots_from_file(f'{runs[ind]}/pedestal_run0.root', figdir=f'{configuration["DataLoc"]}/{modulename}', label=label)
     print(f'  >> Hexmap: Summary plots located in {configuration["DataLoc"]}/{modulename}')
 
 
@@ -334,6 +383,17 @@ def updateconf(conffile, updfile):
     else:
         print(' >> ExternalPC: did not find output yaml file {updfile}, maybe it crashed? Continuing')
 
+def prune_logs(logdir, scriptname, keep):
+    """
+    Deletes all but the newest keep run logs (and their rotated parts) for a script in logdir.
+    """
+
+    logs = glob.glob(f'{logdir}/{scriptname}_[0-9]*.log')
+    logs.sort()
+    for log in logs[:max(len(logs)-keep, 0)]:
+        for part in glob.glob(f'{log}*'):
+            os.remove(part)
+
 def check_hexactrl_sw():
 
     # in Centos7 or Alma9 branch ROCv3, stick to main path of environment and scripts                                                                                                                          
@@ -360,18 +420,268 @@ def check_hexactrl_sw():
     assert os.path.isfile(f'{scriptloc}pedestal_run.py')
 
 
+class HexactrlWorker:
+    """
+    Client for ScriptWorker.py, a process started once in the sourced hexactrl environment which forks a child for
+    each testing script. This saves the bash and python startup and the hexactrl-sw imports on every script.
+    """
+
+    def __init__(self, env, scriptloc, timeout=120.):
+        """
+        Starts the worker and waits up to timeout seconds for it to finish importing. Raises RuntimeError if it
+        exits or does not become ready in time.
+        """
+
+        worker = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'ScriptWorker.py')
+        print(f' >> ExternalPC: Starting hexactrl worker in {env}')
+        self.proc = subprocess.Popen(f'source {env} && exec python3 {worker} {scriptloc}', shell=True, executable="/bin/bash",
+                                     stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        self._buffer = b''
+        self.launches = 0
+
+        reply = self._reply(timeout)
+        if reply is None or not reply.get('ready', False):
+            self.close()
+            raise RuntimeError('hexactrl worker did not start')
+        print(' >> ExternalPC: hexactrl worker ready')
+
+    def alive(self):
+        return self.proc.poll() is None
+
+    def _reply(self, timeout):
+        """
+        Returns the next reply from the worker as a dictionary, or None if none arrives within timeout seconds
+        (None to wait indefinitely). Raises RuntimeError if the worker exits.
+        """
+
+        fd = self.proc.stdout.fileno()
+        while b'\n' not in self._buffer:
+            ready, _, _ = select.select([fd], [], [], timeout)
+            if len(ready) == 0:
+                return None
+            chunk = os.read(fd, 4096)
+            if chunk == b'':
+                raise RuntimeError('hexactrl worker exited')
+            self._buffer += chunk
+        line, self._buffer = self._buffer.split(b'\n', 1)
+        return json.loads(line)
+
+    def submit(self, script, args, output=os.devnull):
+        """
+        Asks the worker to run a script and returns a WorkerJob for it once the child has started.
+        """
+
+        request = {'script': script, 'args': args, 'output': os.path.abspath(output)}
+        self.proc.stdin.write((json.dumps(request) + '\n').encode('ascii'))
+        self.proc.stdin.flush()
+        self.launches += 1
+        return WorkerJob(self, self._reply(None)['pid'])
+
+    def close(self):
+
+        if self.alive():
+            self.proc.stdin.close()
+            try:
+                self.proc.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                self.proc.kill()
+        print(f' >> ExternalPC: hexactrl worker stopped after {self.launches} scripts')
+
+class WorkerJob:
+    """
+    Handle for one script running in the hexactrl worker, with the poll(), wait(), terminate(), and kill() methods of
+    subprocess.Popen.
+    """
+
+    def __init__(self, worker, pid):
+        self.worker = worker
+        self.pid = pid
+        self.returncode = None
+        self._reading = threading.Lock()
+        self._done = threading.Event()
+
+    def _collect(self, timeout):
+        """
+        Waits up to timeout seconds for the exit code. Only one thread reads the worker's reply; any other thread
+        waiting at the same time waits for that one to finish.
+        """
+
+        if self.returncode is not None:
+            return
+        if not self._reading.acquire(blocking=False):
+            self._done.wait(timeout)
+            return
+        try:
+            try:
+                reply = self.worker._reply(timeout)
+            except RuntimeError:
+                reply = {'returncode': 1}
+            if reply is not None:
+                self.returncode = reply['returncode']
+                self._done.set()
+        finally:
+            self._reading.release()
+
+    def poll(self):
+        self._collect(0)
+        return self.returncode
+
+    def wait(self, timeout=None):
+        self._collect(timeout)
+        if self.returncode is None:
+            raise subprocess.TimeoutExpired(self.pid, timeout)
+        return self.returncode
+
+    def terminate(self):
+        if self.returncode is None:
+            try:
+                os.kill(self.pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    def kill(self):
+        """
+        Sends SIGKILL to the script, like Popen.kill (nothing happens if it already exited). Also collects its exit code
+        from the worker, which reaps the child, so the worker is free for the next script.
+        """
+        if self.returncode is None:
+            try:
+                os.kill(self.pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+            self._collect(10)
+
+# Lines in the testing script output that mark the start of a phase, checked in order. The hexactrl-sw scripts do not
+# print a fixed progress format, so apart from an explicit 'phase: <name>' line these match the messages printed while
+# initializing and configuring the ROCs, scanning, taking data, and analyzing. Adjust them to your hexactrl-sw version.
+progressmarkers = [(re.compile(r'phase:\s*(\S+)'), None),
+                   (re.compile(r'[Ii]nitiali[sz]'), 'initialize'),
+                   (re.compile(r'[Cc]onfigur'), 'configure'),
+                   (re.compile(r'[Ss]can'), 'scan'),
+                   (re.compile(r'[Aa]cquir|DAQ|daq'), 'acquire'),
+                   (re.compile(r'[Aa]naly[sz]|[Pp]lot'), 'analysis')]
+
 # Class to handle detached test script processes running on the PC 
 class ScriptProcess:
+    """
+    Runs one testing script in the background. The script's stdout and stderr are read through a non-blocking pipe by
+    a helper thread, which writes them to a log file for this run under DataLoc and follows the progress markers above
+    to time each phase of the script. Log files are capped in size and only the most recent ones per script are kept.
+    """
 
-    def __init__(self, scriptname, command, pc):
+    def __init__(self, scriptname, pc, config=None, maxbytes=10*1024*1024, keep=20):
 
         self.pc = pc
-        self.command = command
         self.scriptname = scriptname
+        config = self.pc.config if config is None else config
+
+        print(f' >> ExternalPC: Running {self.scriptname}.py with config {config}...')
+
+        logdir = f'{configuration["DataLoc"]}/{self.pc.outdir}/script_logs'
+        os.makedirs(logdir, exist_ok=True)
+        prune_logs(logdir, self.scriptname, keep-1)
+        self.logpath = f'{logdir}/{self.scriptname}_{datetime.now().strftime("%Y%m%d_%H%M%S")}.log'
+        self._log = logging.handlers.RotatingFileHandler(self.logpath, maxBytes=maxbytes, backupCount=1)
+
+        self.start = time.monotonic()
+        self.phases = [('startup', self.start)]
+        self.current_phase = 'startup'
+        self.end = None
+
+        # the read end of the pipe must be open before the script opens it for writing
+        self._fifodir = tempfile.mkdtemp(prefix='hgcal-script-')
+        fifo = f'{self._fifodir}/output'
+        os.mkfifo(fifo)
+        self._fd = os.open(fifo, os.O_RDONLY | os.O_NONBLOCK)
+
+        self.proc = self.pc._launch(self.scriptname, config, output=fifo)
+
+        self._reader = threading.Thread(target=self._pump, daemon=True)
+        self._reader.start()
+
+    def _pump(self):
+        """
+        Reads the script output until the script closes it, logging each line and updating the current phase.
+        """
+
+        with span('script', script=self.scriptname, outdir=self.pc.outdir) as timing:
+            partial = b''
+            try:
+                while True:
+                    ready, _, _ = select.select([self._fd], [], [], 1.)
+                    if len(ready) == 0:
+                        continue
+                    try:
+                        chunk = os.read(self._fd, 65536)
+                    except BlockingIOError:
+                        continue
+                    if chunk == b'':
+                        break
+                    lines = (partial + chunk).split(b'\n')
+                    partial = lines.pop()
+                    for line in lines:
+                        self._line(line.decode('utf-8', errors='replace'))
+                if partial != b'':
+                    self._line(partial.decode('utf-8', errors='replace'))
+            finally:
+                self.end = time.monotonic()
+                os.close(self._fd)
+                shutil.rmtree(self._fifodir, ignore_errors=True)
+                times = ', '.join([f'{phase} {round(elapsed, 1)}s' for phase, elapsed in self.phase_times().items()])
+                self._write(f'# phase times: {times}')
+                self._log.close()
+                timing.set(phases={phase: round(elapsed, 2) for phase, elapsed in self.phase_times().items()})
+
+    def _write(self, line):
+        self._log.emit(logging.makeLogRecord({'msg': line}))
+
+    def _line(self, line):
+        """Logs one line of output and starts a new phase if it matches a progress marker
+        """
+        self._write(f'[{round(time.monotonic() - self.start, 2):9.2f}] {line}')
+        for marker, phase in progressmarkers:
+            match = marker.search(line)
+            if match is None:
+                continue
+            phase = match.group(1) if phase is None else phase
+            if phase != self.current_phase:
+                self.current_phase = phase
+                self.phases.append((phase, time.monotonic()))
+            break
+
+    def phase_times(self):
+        """
+        Returns a dictionary of phase name to elapsed seconds, in the order the phases first appeared. Time in a phase
+        that is entered more than once is summed. The last phase runs until the script ends, or until now if it hasn't.
+        """
+
+        times = {}
+        marks = self.phases + [(None, self.end if self.end is not None else time.monotonic())]
+        for (phase, start), (_, stop) in zip(marks[:-1], marks[1:]):
+            times[phase] = times.get(phase, 0.) + stop - start
+        return times
+
+    def wait(self):
+        """Waits for the script to exit and for its output to be logged, then returns its exit code
+        """
+        returncode = self.proc.wait()
+        self._reader.join()
+        return returncode
+
+    def notify(self, window, key='-Script-Finished-'):
+        """
+        Starts a thread which waits for the script to exit and then posts key to the PySimpleGUI window, with the exit
+        code as its value, so the window can block on read() instead of polling is_finished().
+        """
 
-        print(f' >> ExternalPC: Running {self.scriptname}.py with config {self.pc.config}...')
+        def watch():
+            returncode = self.proc.wait()
+            try:
+                window.write_event_value(key, returncode)
+            except Exception:
+                pass # window was already closed, e.g. after Terminate
 
-        self.proc = subprocess.Popen(self.command, shell=True, executable="/bin/bash")
+        threading.Thread(target=watch, daemon=True).start()
 
     def is_finished(self):
 
@@ -388,9 +698,16 @@ class ScriptProcess:
     def end_test(self):
 
         terminated = False
-        if not self.is_finished:
+        if self.proc.poll() is None:
             terminated = True
             self.proc.terminate()
+            try:
+                self.proc.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                self.proc.kill()
+        self._reader.join(timeout=5)
+        print(f' >> ExternalPC: {self.scriptname}.py phase times:', ', '.join([f'{phase} {round(elapsed, 1)}s' for phase, elapsed in self.phase_times().items()]))
+        print(f' >> ExternalPC: {self.scriptname}.py log in {self.logpath}')
 
         runs = glob.glob(f'{configuration["DataLoc"]}/{self.pc.outdir}/{self.scriptname}/*')
         runs.sort()
@@ -1,44 +1,71 @@
 
 import paramiko
 import time
-import os
-
-import yaml
-configuration = {}
-with open('configuration.yaml', 'r') as file:
-    configuration = yaml.safe_load(file)
-
-# required I2C addresses for discovering ROCs by density and geometry. Always second half of the line, but add X7s in as alternates
-# as these addresses sometimes show up and are not a problem.
-listeddevices = {'LF': [['00: -- -- -- -- -- -- -- -- 08 09 0a 0b 0c 0d 0e 0f', '00: -- -- -- -- -- -- -- 07 08 09 0a 0b 0c 0d 0e 0f'],
-                        ['10: -- -- -- -- -- -- -- -- 18 19 1a 1b 1c 1d 1e 1f', '10: -- -- -- -- -- -- -- 17 18 19 1a 1b 1c 1d 1e 1f'],
-                        ['20: -- -- -- -- -- -- -- -- 28 29 2a 2b 2c 2d 2e 2f', '20: -- -- -- -- -- -- -- 27 28 29 2a 2b 2c 2d 2e 2f']],
-                 'LR': [['40: -- -- -- -- -- -- -- -- 48 49 4a 4b 4c 4d 4e 4f', '40: -- -- -- -- -- -- -- 47 48 49 4a 4b 4c 4d 4e 4f'],
-                        ['50: -- -- -- -- -- -- -- -- 58 59 5a 5b 5c 5d 5e 5f', '50: -- -- -- -- -- -- -- 57 58 59 5a 5b 5c 5d 5e 5f']],
-                 'LL': [['40: -- -- -- -- -- -- -- -- 48 49 4a 4b 4c 4d 4e 4f', '40: -- -- -- -- -- -- -- 47 48 49 4a 4b 4c 4d 4e 4f'],
-                        ['50: -- -- -- -- -- -- -- -- 58 59 5a 5b 5c 5d 5e 5f', '50: -- -- -- -- -- -- -- 57 58 59 5a 5b 5c 5d 5e 5f']],
-                 'LT': [['40: -- -- -- -- -- -- -- -- 48 49 4a 4b 4c 4d 4e 4f', '40: -- -- -- -- -- -- -- 47 48 49 4a 4b 4c 4d 4e 4f'],
-                        ['50: -- -- -- -- -- -- -- -- 58 59 5a 5b 5c 5d 5e 5f', '50: -- -- -- -- -- -- -- 57 58 59 5a 5b 5c 5d 5e 5f']],
-                 'LB': [['40: -- -- -- -- -- -- -- -- 48 49 4a 4b 4c 4d 4e 4f', '40: -- -- -- -- -- -- -- 47 48 49 4a 4b 4c 4d 4e 4f'],
-                        ['50: -- -- -- -- -- -- -- -- 58 59 5a 5b 5c 5d 5e 5f', '50: -- -- -- -- -- -- -- 57 58 59 5a 5b 5c 5d 5e 5f']],
-                 'HF': [['00: -- -- -- -- -- -- -- -- 08 09 0a 0b 0c 0d 0e 0f', '00: -- -- -- -- -- -- -- 07 08 09 0a 0b 0c 0d 0e 0f'],
-                        ['10: -- -- -- -- -- -- -- -- 18 19 1a 1b 1c 1d 1e 1f', '10: -- -- -- -- -- -- -- 17 18 19 1a 1b 1c 1d 1e 1f'],
-                        ['20: -- -- -- -- -- -- -- -- 28 29 2a 2b 2c 2d 2e 2f', '20: -- -- -- -- -- -- -- 27 28 29 2a 2b 2c 2d 2e 2f'],
-                        ['40: -- -- -- -- -- -- -- -- 48 49 4a 4b 4c 4d 4e 4f', '40: -- -- -- -- -- -- -- 47 48 49 4a 4b 4c 4d 4e 4f'],
-                        ['50: -- -- -- -- -- -- -- -- 58 59 5a 5b 5c 5d 5e 5f', '50: -- -- -- -- -- -- -- 57 58 59 5a 5b 5c 5d 5e 5f'],
-                        ['60: -- -- -- -- -- -- -- -- 68 69 6a 6b 6c 6d 6e 6f', '60: -- -- -- -- -- -- -- 67 68 69 6a 6b 6c 6d 6e 6f']],
-                 'HL': [['00: -- -- -- -- -- -- -- -- 08 09 0a 0b 0c 0d 0e 0f', '00: -- -- -- -- -- -- -- 07 08 09 0a 0b 0c 0d 0e 0f'],
-                        ['10: -- -- -- -- -- -- -- -- 18 19 1a 1b 1c 1d 1e 1f', '10: -- -- -- -- -- -- -- 17 18 19 1a 1b 1c 1d 1e 1f']],
-                 'HR': [['00: -- -- -- -- -- -- -- -- 08 09 0a 0b 0c 0d 0e 0f', '00: -- -- -- -- -- -- -- 07 08 09 0a 0b 0c 0d 0e 0f'],
-                        ['10: -- -- -- -- -- -- -- -- 18 19 1a 1b 1c 1d 1e 1f', '10: -- -- -- -- -- -- -- 17 18 19 1a 1b 1c 1d 1e 1f']],
-                 'HT': [['10: -- -- -- -- -- -- -- -- 18 19 1a 1b 1c 1d 1e 1f', '10: -- -- -- -- -- -- -- 17 18 19 1a 1b 1c 1d 1e 1f'],
-                        ['20: -- -- -- -- -- -- -- -- 28 29 2a 2b 2c 2d 2e 2f', '20: -- -- -- -- -- -- -- 27 28 29 2a 2b 2c 2d 2e 2f'],
-                        ['50: -- -- -- -- -- -- -- -- 58 59 5a 5b 5c 5d 5e 5f', '50: -- -- -- -- -- -- -- 57 58 59 5a 5b 5c 5d 5e 5f']],
-                 'HB': [['20: -- -- -- -- -- -- -- -- 28 29 2a 2b 2c 2d 2e 2f', '20: -- -- -- -- -- -- -- 27 28 29 2a 2b 2c 2d 2e 2f'],
-                        ['60: -- -- -- -- -- -- -- -- 68 69 6a 6b 6c 6d 6e 6f', '60: -- -- -- -- -- -- -- 67 68 69 6a 6b 6c 6d 6e 6f'],
-                        ['10: -- -- -- -- -- -- -- -- 18 19 1a 1b 1c 1d 1e 1f', '10: -- -- -- -- -- -- -- 17 18 19 1a 1b 1c 1d 1e 1f'],
-                        ['50: -- -- -- -- -- -- -- -- 58 59 5a 5b 5c 5d 5e 5f', '50: -- -- -- -- -- -- -- 57 58 59 5a 5b 5c 5d 5e 5f']]}
+import select
+import socket
+import threading
+
+from Configuration import configuration
+from Timing import span
+
+# I2C rows holding the ROCs by density and geometry. Each ROC answers on the second half of its row (x8-xf); x7 also
+# sometimes shows up and is not a problem, so it is neither required nor rejected.
+rocrows = {'LF': [0x00, 0x10, 0x20],
+           'LR': [0x40, 0x50],
+           'LL': [0x40, 0x50],
+           'LT': [0x40, 0x50],
+           'LB': [0x40, 0x50],
+           'HF': [0x00, 0x10, 0x20, 0x40, 0x50, 0x60],
+           'HL': [0x00, 0x10],
+           'HR': [0x00, 0x10],
+           'HT': [0x10, 0x20, 0x50],
+           'HB': [0x20, 0x60, 0x10, 0x50]}
+
+# file on the FPGA recording the firmware and hexaboard type of the last successful load. /run is cleared when the
+# FPGA reboots, which also unloads the firmware, so the file only exists while that firmware is still loaded. It stands
+# in for asking the FPGA which firmware is loaded: firmware loaded by hand or by another tool afterwards is not seen, so
+# remove the file (or reboot the FPGA) after loading firmware outside this program.
+fwmarker = '/run/hgcal-module-testing-fw'
+
+# required I2C addresses for discovering ROCs
+requiredaddresses = {hbtype: set([row + col for row in rows for col in range(0x8, 0x10)]) for hbtype, rows in rocrows.items()}
+
+def parse_listdevice(output):
+    """
+    Parses the i2cdetect-style table printed by listdevice and returns the set of addresses that responded. Each
+    row starts with its base address (e.g. '10:') followed by 16 three-character cells, which are '--' for no
+    device, 'UU' for an address claimed by a driver, or the address itself. Cells skipped by the scan are blank.
+    """
+
+    found = set()
+    for line in output.splitlines():
+        if len(line) < 3 or line[2] != ':':
+            continue
+        try:
+            row = int(line[:2], 16)
+        except ValueError:
+            continue
+        for col in range(16):
+            cell = line[4+3*col:6+3*col].strip()
+            if cell == '' or cell == '--':
+                continue
+            found.add(row + col)
+    return found
+
+class CommandOutput:
+    """
+    Holds the captured output of a command run over ssh. Has the read() and readlines() interface of the paramiko
+    channel files, so code written against exec_command output works unchanged.
+    """
 
+    def __init__(self, data):
+        self.data = data
+
+    def read(self):
+        return self.data
+
+    def readlines(self):
+        return self.data.decode('ascii', errors='replace').splitlines(keepends=True)
 
 class FPGATestStand:
     """
@@ -46,237 +73,419 @@ class FPGATestStand:
     SSH client and then runs commands over ssh.
     """
    
-    def __init__(self, hostname, modulename, fpgatype='Trenz', keyloc=configuration['PCKeyLoc']):
+    def __init__(self, hostname, modulename, fpgatype='Trenz', keyloc=configuration['PCKeyLoc'], connect_timeout=300., keepalive=15., reconnect_timeout=60.):
         """
-        Instantiates object. Can run as soon as FPGA is powered; will wait until ping succeeds to try 
-        to connect. Some issues with this that are being debugged.
+        Instantiates object. Can run as soon as FPGA is powered; will wait until the FPGA accepts connections on
+        the ssh port and then connect. Raises TimeoutError if the FPGA is not ready within connect_timeout seconds.
+        The ssh transport sends a keepalive every keepalive seconds, and a dropped connection is reopened (waiting
+        up to reconnect_timeout seconds) the next time a command is run.
         """
     
         self.fwloaded = False
         self.services = False
         self.hostname = hostname
         self.fpgatype = fpgatype
+        self._lock = threading.RLock() # one command at a time, the test stand may be shared with a monitoring thread
+        self.keepalive = keepalive
+        self.reconnect_timeout = reconnect_timeout
+        self.ssh_metrics = {'commands': 0, 'reused': 0, 'reconnects': 0, 'reconnect_s': 0.}
         print(f' >> FPGATestStand: Connecting to FPGA at {self.hostname}...')
 
-        time.sleep(2)
-        
-        # wait until can ping test stand                                                                                                                                                              
-        connected = False
-        while not connected:
-            response = os.system("ping -c 1 " + self.hostname + " >/dev/null 2>&1")
-            if response == 0:
-                connected = True
-
-        time.sleep(2)
-                
         # create ssh client                                                                                                                                                                     
         self.ssh = paramiko.SSHClient()
         try:
-            k = paramiko.RSAKey.from_private_key_file(keyloc)
+            self.pkey = paramiko.RSAKey.from_private_key_file(keyloc)
         except paramiko.ssh_exception.SSHException:
-            k = paramiko.Ed25519Key.from_private_key_file(keyloc)
+            self.pkey = paramiko.Ed25519Key.from_private_key_file(keyloc)
         self.ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-        self.ssh.connect(hostname=hostname, username='root', pkey=k)
+        self._wait_and_connect(connect_timeout)
         # at this point, can consider to be "connected"
         print(' >> FPGATestStand: Connected')
 
+        self.set_module(modulename)
+
+    def set_module(self, modulename):
+        """
+        Selects the firmware and ROC layout for the module under test from its serial number. Called by the constructor,
+        and again when a connected test stand is reused for another module, in which case loadfw and startservers must be run again.
+        """
+
         density = modulename.split('-')[1][1]
         shape = modulename.split('-')[2][0]
-        self.fw = ''
+
+        if density == 'L':
+            if shape not in ['F', 'L', 'R', 'T', 'B']:
+                raise NotImplementedError
+        elif density == 'H':
+            if shape not in ['F', 'B', 'T', 'L', 'R']:
+                raise NotImplementedError
+
+        fw = ''
         if density == 'L':
             if self.fpgatype == 'Trenz':
-                self.fw = 'hexaboard-hd-tester-v1p1-trophy-v3'
+                fw = 'hexaboard-hd-tester-v1p1-trophy-v3'
             elif self.fpgatype == 'Kria':
-                self.fw = 'hexaboard-hd-tester-v2p0-trophy-v3'
+                fw = 'hexaboard-hd-tester-v2p0-trophy-v3'
         elif density == 'H':
             if self.fpgatype == 'Trenz':
-                self.fw = 'hexaboard-hd-tester-v1p1-trophy-v2'
+                fw = 'hexaboard-hd-tester-v1p1-trophy-v2'
             elif self.fpgatype == 'Kria':
-                self.fw = 'hexaboard-hd-tester-v2p0-trophy-v2'
+                fw = 'hexaboard-hd-tester-v2p0-trophy-v2'
 
+        # the ROC check in loadfw and the i2c server are specific to the hexaboard, so a new module needs both again
+        if getattr(self, 'modulename', None) != modulename:
+            self.fwloaded = False
+            self.services = False
+            self.fwreused = False
+        self.fw = fw
         self.hbtype = density+shape
+        self.modulename = modulename
 
-        if density == 'L':
-            if shape not in ['F', 'L', 'R', 'T', 'B']:
-                raise NotImplementedError
-        elif density == 'H':
-            if shape not in ['F', 'B', 'T', 'L', 'R']:
-                raise NotImplementedError
-        
-    def _runcmd(self, cmd):
+    def _wait_and_connect(self, timeout):
         """
-        Class to run an arbitrary bash command over ssh. Currently sleeps for three seconds to ensure safety.
+        Waits for the FPGA to boot and connects the ssh client. First probes TCP port 22 directly until it accepts
+        a connection, then retries the ssh login until sshd lets us in. Both waits back off exponentially (0.25s
+        doubling up to 5s) and share one overall deadline. The time from the first probe until the port was
+        reachable and until the login succeeded is stored in self.connect_timing.
         """
 
-        print(' >> FPGATestStand:', cmd)
-        ssh_stdin, ssh_stdout, ssh_stderr = self.ssh.exec_command(cmd)
-        time.sleep(3)
-        ssh_stdin.close()
-
-        return ssh_stdout, ssh_stderr
+        start = time.time()
+        deadline = start + timeout
+
+        delay = 0.25
+        probes = 0
+        while True:
+            probes += 1
+            try:
+                with socket.create_connection((self.hostname, 22), timeout=2.):
+                    break
+            except OSError:
+                if time.time() + delay > deadline:
+                    raise TimeoutError(f'{self.hostname} port 22 not reachable after {timeout}s')
+                time.sleep(delay)
+                delay = min(2*delay, 5.)
+        reachable_s = time.time() - start
+
+        delay = 0.25
+        logins = 0
+        while True:
+            logins += 1
+            try:
+                self.ssh.connect(hostname=self.hostname, username='root', pkey=self.pkey, timeout=10.)
+                break
+            except (paramiko.ssh_exception.NoValidConnectionsError, paramiko.ssh_exception.SSHException, OSError, EOFError):
+                # sshd can accept the tcp connection a little before it is ready to authenticate
+                if time.time() + delay > deadline:
+                    raise TimeoutError(f'could not log in to {self.hostname} after {timeout}s')
+                time.sleep(delay)
+                delay = min(2*delay, 5.)
+        ready_s = time.time() - start
+
+        self.connect_timing = {'reachable_s': reachable_s, 'ready_s': ready_s, 'probes': probes, 'logins': logins}
+        print(f' >> FPGATestStand: port 22 reachable after {round(reachable_s, 1)}s ({probes} probes), ssh ready after {round(ready_s, 1)}s ({logins} attempts)')
+
+        # keep NAT tables and the FPGA's sshd from silently dropping an idle session during long runs
+        self.ssh.get_transport().set_keepalive(int(self.keepalive))
+
+    def connected(self):
+        """Returns True if the ssh transport is open
+        """
+        transport = self.ssh.get_transport()
+        return transport is not None and transport.is_active()
 
-    def loadfw(self):
+    def _reconnect(self):
         """
-        Loads the firmware for the HGCAL testing system. Currently locked to version hexaboard-hd-tester-v1p1-trophy-v3,
-        may allow for selection in the future. After the firmware is loaded, this function prints the I2C devices found
-        and then checks to ensure that the correct channels are discovered. Currently only implemented for LD full boards.
-        Returns True if proper startup detected, otherwise returns False.
+        Closes the current ssh session and opens a new one, waiting up to self.reconnect_timeout seconds.
+        Raises TimeoutError if the FPGA cannot be reached again.
         """
 
-        # activate gpio lines
-        if self.fpgatype == 'Kria':
-            ssh_stdout, ssh_stderr = self._runcmd(f'kconn_pwr on')
-            stdout = ssh_stdout.read().decode('ascii')
+        print(f' -- FPGATestStand: ssh connection to {self.hostname} lost, reconnecting')
+        start = time.time()
+        self.ssh.close()
+        self._wait_and_connect(self.reconnect_timeout)
+        self.ssh_metrics['reconnects'] += 1
+        self.ssh_metrics['reconnect_s'] += time.time() - start
 
-        # load firmware
-        ssh_stdout, ssh_stderr = self._runcmd(f'fw-loader load {self.fw}')
-        stdout = ssh_stdout.read().decode('ascii')
-
-        firmware_loaded = False
-        
-        for line in stdout.split('\n'):
-            print('   >> fw:', line)
+    def connection_summary(self):
+        """Returns a string summarizing how the ssh connection was used since this object was created
+        """
+        m = self.ssh_metrics
+        return f"{m['commands']} commands, {m['reused']} on the existing connection, {m['reconnects']} reconnects in {round(m['reconnect_s'], 1)}s"
 
-        # check fw load
-        if 'Loaded the device tree overlay successfully using the zynqMP FPGA manager' in stdout:
-            print(' >> FPGATestStand: Loaded firmware')
-            firmware_loaded = True
+    def _runcmd(self, cmd, label='ssh', timeout=120.):
+        """
+        Class to run an arbitrary bash command over ssh. Waits until the remote command exits (or until timeout
+        seconds have passed), printing stdout and stderr lines with the given label as they arrive. Returns the
+        captured stdout and stderr; the exit status is stored in self.last_exit_status (None on timeout).
+        """
 
-        for i in range(3):    
-            ssh_stdout, ssh_stderr = self._runcmd(f'listdevice')
-            stdout = ssh_stdout.read().decode('ascii')
-            
-            channels_found = True
+        with self._lock:
+            return self._runcmd_locked(cmd, label, timeout)
 
-            # check channels in listdevice
-            for addressbar in listeddevices[self.hbtype]:
-                if addressbar[0] not in stdout and addressbar[1] not in stdout:
-                    channels_found = False
+    def _runcmd_locked(self, cmd, label, timeout):
 
-            if channels_found:
-                print(' >> FPGATestStand: Discovered ROC channels')
+        print(' >> FPGATestStand:', cmd)
+        self.ssh_metrics['commands'] += 1
+        reused = self.connected()
+        if not reused:
+            self._reconnect()
+        try:
+            ssh_stdin, ssh_stdout, ssh_stderr = self.ssh.exec_command(cmd)
+        except (paramiko.ssh_exception.SSHException, EOFError, OSError):
+            # the transport can look active until the first write fails; the command never started, so it is safe to retry
+            reused = False
+            self._reconnect()
+            ssh_stdin, ssh_stdout, ssh_stderr = self.ssh.exec_command(cmd)
+        if reused:
+            self.ssh_metrics['reused'] += 1
+        ssh_stdin.close()
+        channel = ssh_stdout.channel
+
+        out = b''
+        err = b''
+        partial = {'out': b'', 'err': b''}
+        def stream(key, chunk):
+            lines = (partial[key] + chunk).split(b'\n')
+            partial[key] = lines.pop()
+            for line in lines:
+                print(f'   >> {label}:' if key == 'out' else f'   -- {label}:', line.decode('ascii', errors='replace'))
+
+        start = time.time()
+        timed_out = False
+        while True:
+            # block until there is output or the channel changes state, rather than sleeping a fixed time
+            select.select([channel], [], [], 0.5)
+            while channel.recv_ready():
+                chunk = channel.recv(4096)
+                out += chunk
+                stream('out', chunk)
+            while channel.recv_stderr_ready():
+                chunk = channel.recv_stderr(4096)
+                err += chunk
+                stream('err', chunk)
+            if channel.exit_status_ready() and not channel.recv_ready() and not channel.recv_stderr_ready():
+                break
+            if time.time() - start > timeout:
+                timed_out = True
                 break
 
-        if not channels_found:
-            print(' -- FPGATestStand: unable to find ROC channels in listdevice')
-            return False
-                
+        for key in ['out', 'err']:
+            if partial[key] != b'':
+                stream(key, b'\n')
 
-        if firmware_loaded and channels_found:
-            self.fwloaded = True
-            return True
+        if timed_out:
+            print(f' -- FPGATestStand: no exit status after {timeout}s, continuing')
+            self.last_exit_status = None
         else:
-            return False
+            self.last_exit_status = channel.recv_exit_status()
+        print(f' >> FPGATestStand: finished in {round(time.time() - start, 2)}s with status {self.last_exit_status}')
 
-    
-    def startservers(self):
+        return CommandOutput(out), CommandOutput(err)
+
+    def loaded_setup(self):
         """
-        Starts the DAQ and I2C servers on the FPGA and then checks their status to ensure proper instantiation. Returns True if proper startup
-        detected, otherwise returns False.
+        Returns the firmware and hexaboard type recorded on the FPGA by the last successful loadfw, or (None, None)
+        if the firmware has not been loaded by this program since the FPGA booted. This is only the record of the last
+        load by this program, not a query of the firmware actually loaded (see fwmarker).
         """
 
-        ssh_stdout, ssh_stderr = self._runcmd('systemctl restart daq-server.service && systemctl restart i2c-server.service')
-        time.sleep(3)
+        ssh_stdout, ssh_stderr = self._runcmd(f'cat {fwmarker} 2>/dev/null', label='fw')
+        fields = ssh_stdout.read().decode('ascii').split()
+        if len(fields) != 2:
+            return None, None
+        return fields[0], fields[1]
 
-        error_check = True
+    def loadfw(self, force=False):
+        """
+        Loads the firmware for the HGCAL testing system. Currently locked to version hexaboard-hd-tester-v1p1-trophy-v3,
+        may allow for selection in the future. After the firmware is loaded, this function prints the I2C devices found
+        and then checks to ensure that the correct channels are discovered. Currently only implemented for LD full boards.
+        If the same firmware is already loaded for the same hexaboard type and the ROCs respond, the load is skipped
+        unless force is True. Returns True if proper startup detected, otherwise returns False. The firmware record on the
+        FPGA is removed on any failure, so the next call loads the firmware again.
+        """
+
+        with span('loadfw', hostname=self.hostname, fw=self.fw, force=force) as timing:
+            # activate gpio lines
+            if self.fpgatype == 'Kria':
+                ssh_stdout, ssh_stderr = self._runcmd(f'kconn_pwr on')
+                stdout = ssh_stdout.read().decode('ascii')
+
+            self.fwreused = False
+            if not force and self.loaded_setup() == (self.fw, self.hbtype) and self.discover_rocs(timeout=2.):
+                print(f' >> FPGATestStand: {self.fw} already loaded, skipping fw-loader')
+                timing.set(reused=True)
+                self.fwreused = True
+                self.fwloaded = True
+                return True
+
+            # load firmware; the record only comes back once the load has succeeded
+            ssh_stdout, ssh_stderr = self._runcmd(f'rm -f {fwmarker}', label='fw')
+            try:
+                ssh_stdout, ssh_stderr = self._runcmd(f'fw-loader load {self.fw}', label='fw')
+                stdout = ssh_stdout.read().decode('ascii')
+
+                firmware_loaded = False
+
+                # check fw load
+                if 'Loaded the device tree overlay successfully using the zynqMP FPGA manager' in stdout:
+                    print(' >> FPGATestStand: Loaded firmware')
+                    firmware_loaded = True
+
+                channels_found = self.discover_rocs()
+                if not channels_found:
+                    print(' -- FPGATestStand: unable to find ROC channels in listdevice')
+                    return False
+
+                if firmware_loaded and channels_found:
+                    self._runcmd(f'echo {self.fw} {self.hbtype} > {fwmarker}', label='fw')
+                    self.fwloaded = True
+                    return True
+                else:
+                    return False
+            except Exception:
+                # e.g. the connection dropped while the record was being written
+                self.fwloaded = False
+                try:
+                    self._runcmd(f'rm -f {fwmarker}', label='fw')
+                except Exception:
+                    pass
+                raise
+
+    
+    def discover_rocs(self, timeout=10., interval=0.5):
+        """
+        Polls listdevice until every I2C address required for this hexaboard type responds, or until timeout seconds
+        have passed. Returns True as soon as all ROCs are found, otherwise prints the missing addresses and returns False.
+        """
 
-        ssh_stdout, ssh_stderr = self._runcmd('systemctl status daq-server.service')
-        daq_initiated = False
-        errreadlines = ssh_stderr.readlines()
-        if len(errreadlines) != 0:
-            # catch something specific to Alma9 
-            if not (len(errreadlines) == 1 and 'uio_pdrv_genirq' in errreadlines[0] and configuration['TestingPCOpSys'] == 'Alma9'):
-                error_check = False 
+        required = requiredaddresses[self.hbtype]
+        start = time.time()
+        while True:
+            ssh_stdout, ssh_stderr = self._runcmd('listdevice', label='i2c')
+            missing = required - parse_listdevice(ssh_stdout.read().decode('ascii'))
+
+            if len(missing) == 0:
+                print(f' >> FPGATestStand: Discovered ROC channels after {round(time.time() - start, 2)}s')
+                return True
+            if time.time() - start + interval > timeout:
+                print(' -- FPGATestStand: missing I2C addresses', ' '.join([f'{addr:02x}' for addr in sorted(missing)]))
+                return False
+            time.sleep(interval)
+
+    def startservers(self, force=False):
+        """
+        Starts the DAQ and I2C servers on the FPGA and then checks their status to ensure proper instantiation. Returns True if proper startup
+        detected, otherwise returns False. If loadfw found the firmware already loaded and both servers are still running, they are
+        left alone unless force is True.
+        """
 
-        check1 = False
-        check2 = False
-        for line in ssh_stdout.readlines():
-            print('   >> daq:', line.strip('\n'))
-            if 'Active: active (running)' in line:
-                check1 = True
+        with span('startservers', hostname=self.hostname, force=force) as timing:
+            if not force and self.fwreused:
+                status = self.probeservices()
+                if all([unit['running'] for unit in status.values()]):
+                    print(' >> FPGATestStand: Services already running, skipping restart')
+                    timing.set(reused=True)
+                    self.services = True
+                    return True
+
+            # systemctl restart blocks until the start jobs finish, so no extra wait is needed before checking status
+            ssh_stdout, ssh_stderr = self._runcmd('systemctl restart daq-server.service && systemctl restart i2c-server.service')
+
+            error_check = True
+
+            ssh_stdout, ssh_stderr = self._runcmd('systemctl status daq-server.service', label='daq')
+            daq_initiated = False
+            errreadlines = ssh_stderr.readlines()
+            if len(errreadlines) != 0:
+                # catch something specific to Alma9 
+                if not (len(errreadlines) == 1 and 'uio_pdrv_genirq' in errreadlines[0] and configuration['TestingPCOpSys'] == 'Alma9'):
+                    error_check = False 
+
+            check1 = False
+            check2 = False
+            for line in ssh_stdout.readlines():
+                if 'Active: active (running)' in line:
+                    check1 = True
 
-            if 'Started daq-client start/stop service script.' in line:
-                check2  = True
+                if 'Started daq-client start/stop service script.' in line:
+                    check2  = True
             
-        if check1 and check2:
-            daq_initiated = True
-        if daq_initiated:
-            print(' >> FPGATestStand: DAQ server initiated')
+            if check1 and check2:
+                daq_initiated = True
+            if daq_initiated:
+                print(' >> FPGATestStand: DAQ server initiated')
         
-        ssh_stdout, ssh_stderr = self._runcmd('systemctl status i2c-server.service')    
-        board_discovered = False
-        errreadlines = ssh_stderr.readlines()
-        if len(errreadlines) != 0:
-            # catch something specific to Alma9
-            if not (len(errreadlines) == 1 and 'uio_pdrv_genirq' in errreadlines[0] and configuration['TestingPCOpSys'] == 'Alma9'):
-                error_check = False
-
-        check1 = False
-        for line in ssh_stdout.readlines():
-            print('   >> i2c:', line.strip('\n'))
-            if 'Active: active (running)' in line:
-                check1 = True
-            
-        if check1:
-            board_discovered = True
-        if board_discovered:
-            print(' >> FPGATestStand: Identified Hexaboard')
-
-        if self.fpgatype == 'Kria':
-            print(self.fpgatype, 'adding to firewall')
-            ssh_stdout, ssh_stderr = self._runcmd('firewall-cmd --add-port=5555/tcp --add-port=6000/tcp --add-port=8888/tcp --add-port=8080/tcp')
+            ssh_stdout, ssh_stderr = self._runcmd('systemctl status i2c-server.service', label='i2c')
+            board_discovered = False
+            errreadlines = ssh_stderr.readlines()
+            if len(errreadlines) != 0:
+                # catch something specific to Alma9
+                if not (len(errreadlines) == 1 and 'uio_pdrv_genirq' in errreadlines[0] and configuration['TestingPCOpSys'] == 'Alma9'):
+                    error_check = False
+
+            check1 = False
             for line in ssh_stdout.readlines():
-                print(line)
-            for line in ssh_stderr.readlines():
-                print(line)
+                if 'Active: active (running)' in line:
+                    check1 = True
+            
+            if check1:
+                board_discovered = True
+            if board_discovered:
+                print(' >> FPGATestStand: Identified Hexaboard')
+
+            if self.fpgatype == 'Kria':
+                print(self.fpgatype, 'adding to firewall')
+                ssh_stdout, ssh_stderr = self._runcmd('firewall-cmd --add-port=5555/tcp --add-port=6000/tcp --add-port=8888/tcp --add-port=8080/tcp', label='firewall')
 
             
-        if board_discovered and daq_initiated and error_check:
-            self.services = True
-            print(' >> FPGATestStand: Started services successfully')
-            return True
-        else:
-            self.services = False
-            print(' -- FPGATestStand: Error in starting services')
-            return False
+            if board_discovered and daq_initiated and error_check:
+                self.services = True
+                print(' >> FPGATestStand: Started services successfully')
+                return True
+            else:
+                self.services = False
+                print(' -- FPGATestStand: Error in starting services')
+                return False
 
 
             
-    def statusservers(self):
+    def probeservices(self, units=('daq-server', 'i2c-server')):
         """
-        Check status of DAQ and I2C servers. Returns status of servers as a 2-length tuple.
+        Queries the state of several systemd units on the FPGA with a single `systemctl show` call. Returns a
+        dictionary keyed by unit name (without .service) with the ActiveState, SubState, and a 'running' boolean.
+        Units that systemd does not know about are reported as inactive.
         """
-        
-        error_check = True
-        
-        ssh_stdout, ssh_stderr = self._runcmd('systemctl status daq-server.service')
-        daq_running = False
-
-        errreadlines = ssh_stderr.readlines()
-        if len(errreadlines) != 0:
-            # catch something specific to Alma9
-            if not (len(errreadlines) == 1 and 'uio_pdrv_genirq' in errreadlines[0] and configuration['TestingPCOpSys'] == 'Alma9'):
-                error_check = False
-        
-        for line in ssh_stdout.readlines():
-            print('   >> daq:', line.strip('\n'))
-            if 'Active: active (running)' in line:
-                daq_running = True
 
-            
-        ssh_stdout, ssh_stderr = self._runcmd('systemctl status i2c-server.service')
-        i2c_running = False
-        
-        errreadlines = ssh_stderr.readlines()
-        if len(errreadlines) != 0:
-            # catch something specific to Alma9
-            if not (len(errreadlines) == 1 and 'uio_pdrv_genirq' in errreadlines[0] and configuration['TestingPCOpSys'] == 'Alma9'):
-                error_check = False
+        names = ' '.join([f'{unit}.service' for unit in units])
+        ssh_stdout, ssh_stderr = self._runcmd(f'systemctl show -p Id,ActiveState,SubState {names}', label='systemctl')
+
+        status = {}
+        for unit in units:
+            status[unit] = {'ActiveState': 'inactive', 'SubState': 'dead', 'running': False}
+
+        # properties are printed one unit per block, blocks separated by an empty line
+        for block in ssh_stdout.read().decode('ascii').split('\n\n'):
+            props = dict([line.split('=', 1) for line in block.split('\n') if '=' in line])
+            if 'Id' not in props:
+                continue
+            unit = props['Id'].replace('.service', '')
+            if unit in status:
+                status[unit]['ActiveState'] = props.get('ActiveState', 'inactive')
+                status[unit]['SubState'] = props.get('SubState', 'dead')
+                status[unit]['running'] = (status[unit]['ActiveState'] == 'active' and status[unit]['SubState'] == 'running')
+
+        return status
 
-        for line in ssh_stdout.readlines():
-            print('   >> i2c:', line.strip('\n'))
-            if 'Active: active (running)' in line:
-                i2c_running = True
+    def statusservers(self):
+        """
+        Check status of DAQ and I2C servers. Returns status of servers as a 2-length tuple. Both servers are
+        checked with one round trip through probeservices().
+        """
+
+        status = self.probeservices()
+        daq_running = status['daq-server']['running']
+        i2c_running = status['i2c-server']['running']
 
         if daq_running and  i2c_running:
             print(' >> FPGATestStand: Services up and running')
@@ -296,6 +505,6 @@ class FPGATestStand:
         """
 
         print(' >> FPGATestStand: Shutting down the FPGA test stand')
-        ssh_stdout, ssh_stderr = self._runcmd('shutdown now')
-        time.sleep(5)
+        ssh_stdout, ssh_stderr = self._runcmd('shutdown now', timeout=5.) # connection drops, may never see exit status
+
         return ssh_stdout.readlines(), ssh_stderr.readlines()
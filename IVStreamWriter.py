@@ -0,0 +1,177 @@
+import os
+import glob
+import csv
+import numpy as np
+from datetime import datetime
+
+class IVStreamWriter:
+    """
+    Append-only recorder for IV curves. Every point is written to a CSV file and flushed to disk as soon as it is
+    measured, so a crash or a frozen GUI partway through a sweep does not lose the points already taken. The file
+    starts with commented header lines describing the sweep and ends with a '# complete' line once the sweep is
+    finished, or an '# aborted' line if it was stopped on purpose or by an instrument error. A stream with neither,
+    whose points were all written in full, can be resumed from the last recorded voltage.
+    """
+
+    columns = ['program_v', 'meas_v', 'meas_i', 'meas_r', 'timestamp', 'settle_s', 'high_i_range']
+
+    def __init__(self, path, maxV=None, stepV=None, RH=None, Temp=None):
+        """
+        Opens the stream at path. If the file already exists, its header and points are read back and new points
+        are appended after them; otherwise a new file is created with a header built from the sweep parameters.
+        """
+
+        self.path = path
+        self.header = {}
+        self.points = []
+        self.complete = False
+
+        if os.path.isfile(self.path):
+            self.header, self.points, end, dropped = read_stream(self.path)
+            self.complete = end == 'complete'
+            print(f' >> IVStreamWriter: resuming {self.path} after {len(self.points)} points')
+            self._file = open(self.path, 'a', newline='')
+            self._writer = csv.writer(self._file)
+            # start a fresh line if the last write was cut off
+            with open(self.path, 'rb') as datafile:
+                datafile.seek(-1, os.SEEK_END)
+                if datafile.read(1) != b'\n':
+                    self._file.write('\n')
+        else:
+            start = datetime.now()
+            self.header = {'maxV': maxV, 'stepV': stepV, 'RH': RH, 'Temp': Temp,
+                           'date': start.isoformat().split('T')[0],
+                           'time': start.isoformat().split('T')[1].split('.')[0],
+                           'datetime': start.isoformat()}
+            self._file = open(self.path, 'w', newline='')
+            self._writer = csv.writer(self._file)
+            for key, val in self.header.items():
+                self._file.write(f'# {key}={val}\n')
+            self._writer.writerow(self.columns)
+            self._sync()
+            print(f' >> IVStreamWriter: recording IV points to {self.path}')
+
+    def __del__(self):
+        self.close()
+
+    def _sync(self):
+        """Flushes the file all the way to disk
+        """
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def write_point(self, program_v, meas_v, meas_i, meas_r, settle_s, high_i_range):
+        """
+        Appends one IV point to the stream and flushes it to disk. The timestamp is taken when the point is written.
+        """
+
+        point = {'program_v': float(program_v), 'meas_v': float(meas_v), 'meas_i': float(meas_i), 'meas_r': float(meas_r),
+                 'timestamp': datetime.now().isoformat(), 'settle_s': round(float(settle_s), 3), 'high_i_range': bool(high_i_range)}
+        self._writer.writerow([point[col] for col in self.columns])
+        self._sync()
+        self.points.append(point)
+
+    def finish(self):
+        """Marks the stream as a complete sweep and closes it
+        """
+        if not self._file.closed:
+            self._file.write('# complete\n')
+            self._sync()
+            self.complete = True
+        self.close()
+
+    def abort(self):
+        """Marks the stream as stopped before the end of the sweep, so it is not offered for resuming, and closes it
+        """
+        if not self._file.closed:
+            self._file.write('# aborted\n')
+            self._sync()
+        self.close()
+
+    def close(self):
+        if hasattr(self, '_file') and not self._file.closed:
+            self._file.close()
+
+    def conditions(self):
+        """Returns the RH and temperature recorded in the header, as numbers (None if they were not recorded)
+        """
+        return _number(self.header.get('RH', None)), _number(self.header.get('Temp', None))
+
+    def last_voltage(self):
+        """Returns the last recorded programmed voltage, or None if nothing has been recorded yet
+        """
+        if len(self.points) == 0:
+            return None
+        return self.points[-1]['program_v']
+
+    def data(self):
+        """Returns the recorded points in the [program_v, meas_v, meas_i, meas_r] array format used by the IV datadicts
+        """
+        return np.array([[p['program_v'], p['meas_v'], p['meas_i'], p['meas_r']] for p in self.points])
+
+def _number(val):
+    """Converts a header value back to an int or float, or None for 'None' or a value that isn't a number
+    """
+    try:
+        number = float(val)
+    except (TypeError, ValueError):
+        return None
+    return int(number) if number.is_integer() else number
+
+def read_stream(path):
+    """
+    Reads an IV stream file. Returns the header dictionary, the list of recorded points, how the stream ended
+    ('complete', 'aborted', or None if it was never closed off), and the number of partially written rows dropped.
+    """
+
+    header = {}
+    end = None
+    rows = []
+    with open(path, 'r', newline='') as datafile:
+        for line in datafile:
+            if line.startswith('# complete'):
+                end = 'complete'
+            elif line.startswith('# aborted'):
+                end = 'aborted'
+            elif line.startswith('#'):
+                key, val = line[1:].strip().split('=', 1)
+                header[key] = val
+            else:
+                rows.append(line)
+
+    points = []
+    dropped = 0
+    for row in csv.DictReader(rows):
+        # a partially written final line is dropped
+        if None in row.values() or '' in row.values():
+            dropped += 1
+            continue
+        points.append({'program_v': float(row['program_v']), 'meas_v': float(row['meas_v']),
+                       'meas_i': float(row['meas_i']), 'meas_r': float(row['meas_r']),
+                       'timestamp': row['timestamp'], 'settle_s': float(row['settle_s']),
+                       'high_i_range': row['high_i_range'] == 'True'})
+
+    return header, points, end, dropped
+
+def find_resumable_stream(directory, moduleserial, maxV, stepV):
+    """
+    Returns the path of the most recent interrupted IV stream for this module in the given directory that was taken
+    with the same maximum and step voltages, or None if there isn't one. Only streams that were neither completed nor
+    aborted, with every row written in full and the points following the steps from 0 V without a gap, are offered.
+    """
+
+    streams = glob.glob(f'{directory}/{moduleserial}_IVstream_*.csv')
+    streams.sort()
+    for path in reversed(streams):
+        try:
+            header, points, end, dropped = read_stream(path)
+        except Exception:
+            continue
+        if end is not None or dropped > 0 or len(points) == 0:
+            continue
+        if not all([abs(point['program_v'] - i*float(stepV)) < 1e-6 for i, point in enumerate(points)]):
+            continue
+        if float(header.get('maxV', 'nan')) == float(maxV) and float(header.get('stepV', 'nan')) == float(stepV):
+            return path
+
+    return None
@@ -1,19 +1,21 @@
 import pyvisa
-from time import sleep, time
+from time import sleep, time, monotonic
 from datetime import datetime
 from math import copysign
 import numpy as np
 import subprocess
+import threading
 from collections import deque
 
-import yaml
-configuration = {}
-with open('configuration.yaml', 'r') as file:
-    configuration = yaml.safe_load(file)
+from Configuration import configuration
+from Timing import span
 
 class Keithley2410:
 
     def __init__(self):
+        # one command or query at a time on the serial port, as the IV curve and the interlock monitor run in threads
+        self._lock = threading.RLock()
+
         # Initiate and configure PyVISA:
         self._rm = pyvisa.ResourceManager('@py')
         self._resource_list = self._rm.list_resources()
@@ -62,6 +64,7 @@ class Keithley2410:
         self._write("SYSTem:REMote")
 
         self.voltage_now = 0.
+        self._source_mode = None # (function, mode) last written to the source, to avoid rewriting it every setpoint
 
         if configuration['HVTerminal'] == 'Rear':
             self._write('ROUTe:TERMinals REAR')
@@ -77,6 +80,8 @@ class Keithley2410:
 
         self._write(f"SOURCe{self._channel}:CLEar:AUTO ON")
         self._write(f"SENSe{self._channel}:FUNCtion:CONCurrent OFF")
+        # readings can be sent as 4-byte floats instead of ~60 ASCII characters, much faster over RS232
+        self.set_data_format(binary=('HVBinaryTransfer' in configuration.keys() and configuration['HVBinaryTransfer']))
         # self._write("FORMat:ELEMents VOLTage, CURRent, RESistance, TIME, STATus")
         self.set_elements(self._elements)
         self.set_current_limit(self._ilimit)
@@ -95,6 +100,12 @@ class Keithley2410:
 
         self.bv_ramp_step = 25.
         self.bv_ramp_wait = 0.5
+        self.bv_ramp_rate = self.bv_ramp_step / self.bv_ramp_wait # V/s
+
+        # time spent ramping the bias voltage this session
+        self.ramp_time_s = 0.
+        self.ramp_count = 0
+        self.ramp_skipped = 0
 
         
     def __del__(self):
@@ -108,28 +119,60 @@ class Keithley2410:
         self.set_output_enable(0)
         self._write("SYSTem:LOCal")
 
-    def _write(self, writeStr):
+    def _write(self, writeStr, wait = None):
         print(' >> Keithley2410 Write:', writeStr)
         """Write command with built-in delay. Defaults to 100ms
         """
-        self._inst.write(writeStr)
-        sleep(self._wait_time_s)
+        if wait is None:
+            wait = self._wait_time_s
+        with self._lock:
+            self._inst.write(writeStr)
+            sleep(wait)
 
-    def _query(self, queryStr, wait = None):
+    def _query(self, queryStr, wait = None, verbose = True):
         """Query command returns most recent buffer
         """
-        print(' >> Keithley2410 Query:', queryStr)
+        if verbose:
+            print(' >> Keithley2410 Query:', queryStr)
         if wait is None:
             wait = self._wait_time_s
-        response = self._inst.query(queryStr, wait).strip("\r\n")
-        print(' >> Keithley2410 Response:', response)
+        with self._lock:
+            response = self._inst.query(queryStr, wait).strip("\r\n")
+        if verbose:
+            print(' >> Keithley2410 Response:', response)
         return response
 
+    def _query_readings(self, queryStr, wait = None):
+        """Query command for instrument readings (READ?, FETCh?). Returns the readings parsed into a structured array.
+        Uses a binary block transfer if the data format is set to binary, otherwise an ASCII query.
+        """
+        if not self.binary_transfer:
+            return self._parse_buffer(self._query(queryStr, wait))
+
+        print(' >> Keithley2410 Query (binary):', queryStr)
+        if wait is None:
+            wait = self._wait_time_s
+        with self._lock:
+            values = self._inst.query_binary_values(queryStr, datatype='f', is_big_endian=True, delay=wait)
+        data = self._parse_buffer(values)
+        print(' >> Keithley2410 Response:', data)
+        return data
+
+    def set_data_format(self, binary):
+        """Sets the format readings are transferred in: single precision binary (SREal) if binary is true, otherwise ASCII.
+        """
+        self.binary_transfer = binary
+        if binary:
+            print(' -- Keithley2410: binary transfer is not yet verified on the hardware, check the first readings')
+            self._write("FORMat:DATA SREal")
+            self._write("FORMat:BORDer NORMal")
+        else:
+            self._write("FORMat:DATA ASCii")
+
     def _read(self):
         """Performs a read command and returns the parsed response
         """
-        response = self._query("READ?")
-        return self._parse_data(response)
+        return self._query_readings("READ?")
 
     def set_elements(self, element_list):
         """Sets the elements returned in a read command
@@ -157,33 +200,47 @@ class Keithley2410:
                 raise ValueError("Undefined element")
         self._write("FORMat:ELEMents " + element_string)
 
-    def _parse_data(self, response):
-        """Parses the received data into an array of dictionaries
+    def _parse_buffer(self, response):
+        """Parses a buffer of readings into a structured NumPy array with one field per element in self._elements.
+        Accepts the ASCII comma-separated response, a raw binary block from FORMat:DATA REAL,32, or a sequence of
+        floats already decoded by pyvisa. The status word is stored as an integer, all other fields as floats.
         """
-        response_list = response.split(",")
         num_elements = len(self._elements)
-        if len(response_list) >= num_elements:
-            data = []
-            for i in range(0, int(len(response_list) / num_elements)):
-                single_response = response_list[(num_elements * i):(num_elements * (i + 1) - 1)]
-                element = dict(zip(self._elements, single_response))
-                data.append(element)
-            return data
+
+        if isinstance(response, (bytes, bytearray)):
+            # IEEE 488.2 definite length block: #<number of digits><number of bytes><data>
+            if response[0:1] == b'#':
+                ndigits = int(response[1:2])
+                nbytes = int(response[2:2+ndigits])
+                response = response[2+ndigits:2+ndigits+nbytes]
+            values = np.frombuffer(response, dtype='>f4').astype(np.float64) # default byte order is NORMal (big endian)
+        elif isinstance(response, str):
+            values = np.fromstring(response, dtype=np.float64, sep=',')
         else:
-            return response
+            values = np.asarray(response, dtype=np.float64)
+
+        nreadings = len(values) // num_elements
+        values = values[:nreadings*num_elements].reshape(nreadings, num_elements)
+
+        dtype = [(element, np.uint32 if element == 'status' else np.float64) for element in self._elements]
+        data = np.empty(nreadings, dtype=dtype)
+        for i, element in enumerate(self._elements):
+            data[element] = values[:, i]
+        return data
 
     def _read_async(self):
-        """Waits for data to be available for reading. Returns the response when available.
+        """Waits for data to be available for reading. Returns the parsed readings when available.
         """
-        self._write("INIT; *OPC?")
-        opc_status = 0
-        while opc_status != 1:
-            try:
-                status_raw = self._inst.read_raw()  # For some reason Python prints new lines after read()
-                opc_status = int(status_raw.decode('ASCII').strip("\r\n"))
-            except pyvisa.errors.VisaIOError:
-                sleep(1)
-        response = self._query("FETCh?", 5.)
+        with self._lock:
+            self._write("INIT; *OPC?")
+            opc_status = 0
+            while opc_status != 1:
+                try:
+                    status_raw = self._inst.read_raw()  # For some reason Python prints new lines after read()
+                    opc_status = int(status_raw.decode('ASCII').strip("\r\n"))
+                except pyvisa.errors.VisaIOError:
+                    sleep(1)
+            response = self._query_readings("FETCh?", 5.)
         return response
 
     def get_id(self):
@@ -253,21 +310,23 @@ class Keithley2410:
         itrip = int(self._query(f"SENSe{self._channel}:CURRent:PROTection:TRIPped?"))
         return (vtrip or itrip)
 
-    def get_enable_tripped(self):
+    def get_enable_tripped(self, verbose=True):
         """Returns 1 if the output enable line has been tripped. (Tripped means the output can be enabled)
         """
-        status = int(self._query("OUTPut:ENABle:TRIPped?"))
+        status = int(self._query("OUTPut:ENABle:TRIPped?", verbose=verbose))
         return status
         
-    def switch_state(self):
+    def switch_state(self, verbose=True):
         """Renaming of above class for compatibility
         """
-        return bool(self.get_enable_tripped())
+        return bool(self.get_enable_tripped(verbose))
 
     def set_source_voltage_mode(self, mode):
         """Sets the source mode to voltage with the defined mode.
         Options are fixed, list, or sweep.
         """
+        if self._source_mode == ("voltage", mode):
+            return
         self._write(f"SOURce{self._channel}:FUNCtion VOLTage")
         if mode == "fixed":
             self._write(f"SOURce{self._channel}:VOLTage:MODE FIXed")
@@ -277,11 +336,13 @@ class Keithley2410:
             self._write(f"SOURce{self._channel}:VOLTage:MODE SWEep")
         else:
             raise ValueError("Invalid mode selection")
+        self._source_mode = ("voltage", mode)
 
     def set_source_current_mode(self, mode):
         """Sets the source mode to current with the defined mode.
         Options are fixed, list, or sweep.
         """
+        self._source_mode = None
         self._write(f"SOURce{self._channel}:FUNCtion CURRent")
         if mode == "fixed":
             self._write(f"SOURce{self._channel}:CURRent:MODE FIXed")
@@ -295,29 +356,55 @@ class Keithley2410:
     def set_source_voltage(self, value):
         """Sets the source mode to fixed voltage with the defined value. If the set voltage is
         sufficiently different from the current voltage, the output will be slowly ramped to that
-        new voltage.
+        new voltage. If the source is already at that voltage, only the output state is queried.
         """
+        value = float(value)
+        # checked first, so a skipped setpoint can't hide an output that was turned off or dropped by the interlock
         if not self.get_output() and value != 0.:
             raise ValueError('Output must be on to change output voltage')
             return
 
+        if value == self.voltage_now and self._source_mode == ("voltage", "fixed"):
+            print(f' >> Keithley2410: already at {value}V, skipping ramp')
+            self.ramp_skipped += 1
+            return
+
         if self._VOLTAGE_LIMIT_LOW <= abs(value) <= self._vlimit:
 
             self.set_source_voltage_mode("fixed")
-
-            # ramp up the voltage slowly if it's very different than current voltage
-            difference = value - self.voltage_now
-            if abs(difference) > self.bv_ramp_step:
-                for i in range(1, int(abs(difference) // self.bv_ramp_step) + 1):
-                    this_voltage = self.voltage_now + self.bv_ramp_step*i*copysign(1, difference)
-                    self._write(f"SOURce{self._channel}:VOLTage {this_voltage}")
-                    sleep(self.bv_ramp_wait)
-
-            self.voltage_now = value
-            self._write(f"SOURce{self._channel}:VOLTage {value}")
+            self._ramp_voltage(value)
         else:
             raise ValueError("Invalid set voltage")
 
+    def _ramp_voltage(self, value):
+        """Ramps the source voltage to value at no more than bv_ramp_rate V/s, in steps of at most
+        bv_ramp_step V. Each step is scheduled from the start of the ramp, so time spent talking to the
+        instrument counts towards the wait instead of being added on top of it.
+        """
+        start = monotonic()
+        difference = value - self.voltage_now
+        if abs(difference) > self.bv_ramp_step:
+            step_time = self.bv_ramp_step / self.bv_ramp_rate
+            for i in range(1, int(abs(difference) // self.bv_ramp_step) + 1):
+                this_voltage = self.voltage_now + self.bv_ramp_step*i*copysign(1, difference)
+                self._write(f"SOURce{self._channel}:VOLTage {this_voltage}", 0.)
+                remaining = start + i*step_time - monotonic()
+                if remaining > 0:
+                    sleep(remaining)
+
+        self.voltage_now = value
+        self._write(f"SOURce{self._channel}:VOLTage {value}")
+
+        elapsed = monotonic() - start
+        self.ramp_time_s += elapsed
+        self.ramp_count += 1
+        print(f' >> Keithley2410: ramped by {difference}V to {value}V in {round(elapsed, 2)}s')
+
+    def ramp_summary(self):
+        """Returns a string summarizing the time spent ramping the bias voltage since this object was created
+        """
+        return f'{self.ramp_count} ramps in {round(self.ramp_time_s, 1)}s, {self.ramp_skipped} skipped at same setpoint'
+
     def setVoltage(self, value):
         """Renaming of above function for compatibility
         """
@@ -354,8 +441,8 @@ class Keithley2410:
         if self._sense_mode != "voltage":
             self.set_sense_mode("voltage")
         self._write("CONFigure:VOLTage:DC")
-        measurement = self._query("READ?")
-        return float(self._parse_data(measurement)[0]['voltage'])
+        measurement = self._query_readings("READ?")
+        return float(measurement['voltage'][0])
 
     def measureVoltage(self):
         """Renaming of above function for compatibility
@@ -378,20 +465,21 @@ class Keithley2410:
         
         start = time()
         while True:
-            measurement = self._query("READ?", 0.)
+            measurement = self._query_readings("READ?", 0.)
             if time() - start >= 3.:
                 break
-        measurement = self._query("READ?", 0.)
-        return float(self._parse_data(measurement)[0]['current'])
+        measurement = self._query_readings("READ?", 0.)
+        return float(measurement['current'][0])
 
     def measureCurrent(self):
         """Renaming of above function for compatibility
         """
         return '', self.get_sense_current(), ''
 
-    def measureCurrentLoop(self):
+    def measureCurrentLoop(self, abort=None):
         # Measure current                                                                                                                                             
         # Current stabilizes much faster when you ask for a measurement continually                                                                                              
+        # Returns None for the current if the threading.Event abort is set while waiting for it to settle
         if self._sense_mode != "current":
             self.set_sense_mode("current")
         self._write("CONFigure:CURRent:DC")
@@ -407,9 +495,9 @@ class Keithley2410:
 
         # repetetively query current measurement
         while True:
-            measurement = self._query("READ?", 0.)
+            measurement = self._query_readings("READ?", 0.)
 
-            thiscurrent = float(self._parse_data(measurement)[0]['current'])
+            thiscurrent = float(measurement['current'][0])
             q.append(thiscurrent)
 
             if thiscurrent > (50. * 10**(-6)) and not self.high_i_range:
@@ -426,9 +514,12 @@ class Keithley2410:
             # if greater than time limit, break
             if time() - start >= maxtime:
                 break
+
+            if abort is not None and abort.is_set():
+                return '', None, ''
             
-        measurement = self._query("READ?", 0.)
-        meascurr = float(self._parse_data(measurement)[0]['current'])
+        measurement = self._query_readings("READ?", 0.)
+        meascurr = float(measurement['current'][0])
         return '', meascurr, ''
 
     def voltage_sweep(self, Vmin, Vmax, steps, Ilimit=1.5e-3, delay_s=1.):
@@ -448,14 +539,14 @@ class Keithley2410:
             self._write(f"SOURce{self._channel}:VOLTage:STOP {Vmax}")
             self._write(f"SOURce{self._channel}:VOLTage:STEP {Vstep}")
             self._write(f"SOURce{self._channel}:VOLTage:MODE SWEep")
+            self._source_mode = ("voltage", "sweep")
             self._write(f"SOURce{self._channel}:SWEep:SPACing LINear")
             self._write(f"TRIGger:COUNt {steps+1}")
             self._write(f"SOURce{self._channel}:DELay {delay_s}")
             self.set_output(1)
-            sweep_data = self._read_async()
+            parsed_data = self._read_async()
             self.voltage_now = Vmax
             self.set_output(0)
-            parsed_data = self._parse_data(sweep_data)
 
             self._write(f"SOURce{self._channel}:DELay {0.}")
 
@@ -477,9 +568,9 @@ class Keithley2410:
         steps = int(Vmax//step)
         ivdata = self.voltage_sweep(0, Vmax, steps, delay_s=5.)
         
-        temparray = [[i*step, float(ivdata[i]['voltage']), float(ivdata[i]['current']), float(ivdata[i]['resistance'])] for i in range(len(ivdata))]
+        temparray = np.column_stack([np.arange(len(ivdata))*step, ivdata['voltage'], ivdata['current'], ivdata['resistance']])
 
-        datadict = {'RH': RH, 'Temp': Temp, 'data': np.array(temparray), 'date': date, 'time': time, 'datetime': current_date}
+        datadict = {'RH': RH, 'Temp': Temp, 'data': temparray, 'date': date, 'time': time, 'datetime': current_date}
         self.IVdata.append(datadict)
                 
         return datadict
@@ -517,7 +608,18 @@ class Keithley2410:
 
     # Take IV curve - now using internal voltage sweep function on Keithley
     # Storing/plotting curve handled elsewhere
-    def takeIVnew(self, maxV, stepV, RH, Temp, errcheck_step=5):
+    def takeIVnew(self, maxV, stepV, RH, Temp, errcheck_step=5, stream=None, progress=None, abort=None):
+        """
+        Loops over the bias voltages from 0 to maxV in steps of stepV, measuring the current at each point. If an
+        IVStreamWriter is given as stream, each point is written to disk as soon as it is measured, and if the stream
+        already holds points from an interrupted sweep, the loop resumes after the last recorded voltage and the curve
+        keeps the RH and temperature recorded in the stream's header.
+
+        To run from a worker thread, pass a queue as progress to receive each [V, Vmeas, I, R] row as it is measured,
+        and a threading.Event as abort. If abort is set, the loop stops after the current point (or drops it if it is
+        still settling), the output is ramped down to 0 V and turned off, and None is returned. The stream is marked
+        aborted, as it is when a point fails, so it is not offered for resuming.
+        """
 
         self.setVoltage(0.)
         self.outputOn()
@@ -525,34 +627,74 @@ class Keithley2410:
         ln = int(maxV//stepV)+1
         data = [] # append measurements to this list as rows
 
-        self.display_string('Looping...')
-        print(f' >> Keithley2410: Looping to {maxV}V in steps of {stepV}V')
-        sleep(5)
-
-        # Record date
+        # Record date, or reuse the start of an interrupted sweep
         current_date = datetime.now()
+        first = 0
+        if stream is not None and stream.last_voltage() is not None:
+            data = stream.data().tolist()
+            first = int(round(stream.last_voltage() / stepV)) + 1
+            current_date = datetime.fromisoformat(stream.header['datetime'])
+            RH, Temp = stream.conditions() # the box conditions of the first part of the curve
+            print(f' >> Keithley2410: Resuming IV curve after {stream.last_voltage()}V')
         date = current_date.isoformat().split('T')[0]
         time = current_date.isoformat().split('T')[1].split('.')[0]
 
+        self.display_string('Looping...')
+        print(f' >> Keithley2410: Looping to {maxV}V in steps of {stepV}V')
+        sleep(5)
+
         # Count the number of measurements that hit current compliance
         # Break the loop after the second to save time
         compl_ctr = 0
-        for i in range(0, ln):
+        for i in range(first, ln):
             if i % errcheck_step == 0:
                 self.check_for_errors(1) # Periodically check Keithley error cache
 
             vltg = i*stepV
-            self.setVoltage(vltg)
-            # Delay here doesn't work for some reason
-            # maybe because the Keithley isn't in measure mode?
-            _, current, _ = self.measureCurrentLoop()
-            voltage, _, _ = self.measureVoltage()
-            resistance = voltage / current
-
-            data.append([vltg, voltage, np.abs(current), resistance])
+            try:
+                # the whole point is one transaction, so the interlock monitor can't query between its commands
+                with span('iv_point', V=vltg), self._lock:
+                    self.setVoltage(vltg)
+                    # Delay here doesn't work for some reason
+                    # maybe because the Keithley isn't in measure mode?
+                    settle_start = monotonic()
+                    _, current, _ = self.measureCurrentLoop(abort=abort)
+                    settle_s = monotonic() - settle_start
+                    if current is not None: # None if aborted while settling
+                        voltage, _, _ = self.measureVoltage()
+                        resistance = voltage / current
+            except Exception:
+                # close off the stream and bring the bias down, then let the caller report the error
+                print(f' -- Keithley2410: IV point at {vltg}V failed, ramping down')
+                if stream is not None:
+                    stream.abort()
+                try:
+                    self.setVoltage(0.)
+                    self.outputOff()
+                except Exception:
+                    print(' -- Keithley2410: unable to ramp down after failed IV point')
+                raise
+
+            if current is not None:
+                data.append([vltg, voltage, np.abs(current), resistance])
+                if stream is not None:
+                    stream.write_point(vltg, voltage, np.abs(current), resistance, settle_s, self.high_i_range)
+                if progress is not None:
+                    progress.put(data[-1])
+
+            if abort is not None and abort.is_set():
+                print(f' >> Keithley2410: IV curve aborted at {vltg}V, ramping down')
+                if stream is not None:
+                    stream.abort()
+                self.setVoltage(0.)
+                self.outputOff()
+                self.display_string('Loop aborted.')
+                return None
 
         self.display_string('Loop finished.')
         print(' >> Keithley2410: Loop finished')
+        if stream is not None:
+            stream.finish()
         
         # Make output dictionary and return
         datadict = {'RH': RH, 'Temp': Temp, 'data': np.array(data), 'date': date, 'time': time, 'datetime': current_date}
@@ -562,3 +704,53 @@ class Keithley2410:
         self.outputOff()
 
         return datadict
+
+class InterlockMonitor:
+    """
+    Polls the dark box switch (the output enable line of the Keithley) every interval seconds in a background thread
+    and keeps the last reading, so the lid state can be checked without a serial round trip. A poll is skipped while
+    another thread holds the Keithley's lock, so it never waits on a command in progress. The lock is held per command
+    or query, and for the whole of each point of takeIVnew; other multi-command sequences (e.g. a ramp, or the
+    leakage current check) may have a poll between two of their commands, which does not change the instrument's
+    settings. Calls on_change(closed) from the polling thread when the lid is opened or closed, including on the first
+    reading.
+    """
+
+    def __init__(self, ps, interval=1., on_change=None):
+
+        self.ps = ps
+        self.interval = interval
+        self.on_change = on_change
+        self.closed = None # not read yet
+        self.updated = None
+        self.errors = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+
+        while not self._stop.is_set():
+            if self.ps._lock.acquire(blocking=False):
+                try:
+                    closed = self.ps.switch_state(verbose=False)
+                except (pyvisa.errors.VisaIOError, ValueError):
+                    print(' -- Keithley2410: interlock poll failed')
+                    self.errors += 1
+                    closed = None
+                finally:
+                    self.ps._lock.release()
+
+                if closed is not None:
+                    changed = closed != self.closed
+                    self.closed = closed
+                    self.updated = time()
+                    if changed:
+                        print(f' >> Keithley2410: dark box {"closed" if closed else "open"}')
+                        if self.on_change is not None:
+                            self.on_change(closed)
+            self._stop.wait(self.interval)
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
@@ -1,11 +1,9 @@
 import asyncpg
 import asyncio
-import yaml
 
 # Load configuration file
-configuration = {}
-with open('configuration.yaml', 'r') as file:
-    configuration = yaml.safe_load(file)
+from Configuration import configuration
+from Timing import span
 
 
 def get_query_old(table_name):
@@ -61,40 +59,41 @@ async def upload_PostgreSQL(table_name, db_upload_data):
     General upload function. Instantiates the connection to the database, formats the query, and uploads the data.
     """
     
-    # create db connection
-    conn = await asyncpg.connect(
-        host = configuration['DBHostname'],
-        database = configuration['DBDatabase'],
-        user = configuration['DBUsername'],
-        password = configuration['DBPassword']
-    )
+    with span('db_upload', table=table_name):
+        # create db connection
+        conn = await asyncpg.connect(
+            host = configuration['DBHostname'],
+            database = configuration['DBDatabase'],
+            user = configuration['DBUsername'],
+            password = configuration['DBPassword']
+        )
     
-    print(f'  >> Postgres Tools: Connection successful.')
-
-    # define query to check if table exists
-    schema_name = 'public'
-    table_exists_query = """
-    SELECT EXISTS (
-        SELECT 1 
-        FROM information_schema.tables 
-        WHERE table_schema = $1 
-        AND table_name = $2
-    );
-    """
-
-    # check table exists and upload
-    table_exists = await conn.fetchval(table_exists_query, schema_name, table_name)  ### Returns True/False
-    if table_exists:
-
-        # new db uploading scheme
-        query = get_query(table_name, db_upload_data.keys())
-        print(f'  >> PostgresTools: Executing query: {query}')
-        await conn.execute(query, *db_upload_data.values())
-
-        print(f'  >> PostgresTools: Data is successfully uploaded to the {table_name}!')
-    else:
-        print(f'  >> PostgresTools: Table {table_name} does not exist in the database.')
-    await conn.close()
+        print(f'  >> Postgres Tools: Connection successful.')
+
+        # define query to check if table exists
+        schema_name = 'public'
+        table_exists_query = """
+        SELECT EXISTS (
+            SELECT 1 
+            FROM information_schema.tables 
+            WHERE table_schema = $1 
+            AND table_name = $2
+        );
+        """
+
+        # check table exists and upload
+        table_exists = await conn.fetchval(table_exists_query, schema_name, table_name)  ### Returns True/False
+        if table_exists:
+
+            # new db uploading scheme
+            query = get_query(table_name, db_upload_data.keys())
+            print(f'  >> PostgresTools: Executing query: {query}')
+            await conn.execute(query, *db_upload_data.values())
+
+            print(f'  >> PostgresTools: Data is successfully uploaded to the {table_name}!')
+        else:
+            print(f'  >> PostgresTools: Table {table_name} does not exist in the database.')
+        await conn.close()
 
 def get_query_read(table_name, part_name = None):
     """
@@ -0,0 +1,119 @@
+import os
+import sys
+import ast
+import glob
+import json
+import runpy
+import importlib
+import traceback
+
+"""
+-------------------ScriptWorker.py-----------------
+
+Long-lived helper process for running the hexactrl-sw testing scripts. ExternalPC starts it once per session inside
+the sourced hexactrl environment:
+
+    source env.sh && python3 ScriptWorker.py /opt/hexactrl/.../ctrl/
+
+On startup it imports everything the testing scripts import, so that cost is paid once. It then reads one JSON
+request per line on stdin, {"script": ..., "args": [...], "output": ...}, and for each one forks a child which runs
+the script as __main__ with its output sent to the given file or pipe. The worker answers on stdout with {"pid": ...} as soon
+as the child is started and {"returncode": ...} when it exits. Requests are handled one at a time.
+"""
+
+def preload(scriptloc):
+    """
+    Imports the top-level modules used by the testing scripts in scriptloc. Modules that fail to import are skipped;
+    the script will then import (and fail on) them itself in the child.
+    """
+
+    modules = set()
+    for script in glob.glob(f'{scriptloc}*.py'):
+        try:
+            with open(script, 'r') as file:
+                tree = ast.parse(file.read())
+        except (SyntaxError, UnicodeDecodeError):
+            continue
+        for node in tree.body:
+            if isinstance(node, ast.Import):
+                modules.update([alias.name for alias in node.names])
+            elif isinstance(node, ast.ImportFrom) and node.level == 0 and node.module is not None:
+                modules.add(node.module)
+
+    loaded = 0
+    for module in sorted(modules):
+        try:
+            importlib.import_module(module)
+            loaded += 1
+        except BaseException:
+            continue
+    print(f' >> ScriptWorker: preloaded {loaded} of {len(modules)} modules', file=sys.stderr)
+
+def run_child(script, args, fd):
+    """
+    Runs in the forked child. Sends stdout and stderr to the file descriptor fd, runs the script as __main__ with the
+    given arguments, and exits with the script's exit code.
+    """
+
+    code = 0
+    try:
+        os.dup2(fd, 1)
+        os.dup2(fd, 2)
+        os.close(fd)
+        sys.stdout = os.fdopen(1, 'w', buffering=1)
+        sys.stderr = os.fdopen(2, 'w', buffering=1)
+        sys.stdin = open(os.devnull, 'r')
+
+        sys.argv = [script] + args
+        sys.path.insert(0, os.path.dirname(script))
+        runpy.run_path(script, run_name='__main__')
+    except SystemExit as e:
+        if e.code is None:
+            code = 0
+        elif isinstance(e.code, int):
+            code = e.code
+        else:
+            print(e.code, file=sys.stderr)
+            code = 1
+    except BaseException:
+        traceback.print_exc()
+        code = 1
+    finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os._exit(code)
+
+def main():
+
+    scriptloc = sys.argv[1]
+
+    # keep the protocol on its own descriptor so stray prints from imports cannot corrupt it
+    replies = os.fdopen(os.dup(1), 'w', buffering=1)
+    os.dup2(2, 1)
+    sys.path.insert(0, scriptloc)
+    preload(scriptloc)
+    replies.write(json.dumps({'ready': True}) + '\n')
+
+    for line in sys.stdin:
+        if line.strip() == '':
+            continue
+        request = json.loads(line)
+
+        # open the output before answering so that a pipe is already connected when the client starts reading it
+        fd = os.open(request.get('output', os.devnull), os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        pid = os.fork()
+        if pid == 0:
+            replies.close()
+            run_child(request['script'], request['args'], fd)
+        os.close(fd)
+
+        replies.write(json.dumps({'pid': pid}) + '\n')
+        pid, status = os.waitpid(pid, 0)
+        if os.WIFSIGNALED(status):
+            returncode = -os.WTERMSIG(status)
+        else:
+            returncode = os.WEXITSTATUS(status)
+        replies.write(json.dumps({'returncode': returncode}) + '\n')
+
+if __name__ == '__main__':
+    main()
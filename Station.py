@@ -0,0 +1,92 @@
+import os
+import sys
+import subprocess
+import yaml
+
+"""
+-------------------Station.py-----------------
+
+Lets one testing PC run several test stations at once, each with its own hexacontroller, Keithley, DAQ client, and
+dark box. The stations are listed in configuration.yaml under `Stations`; each one is a dictionary of configuration
+values which replace the top-level values for that station, for example:
+
+    Stations:
+      A: {FPGAHostname: ['192.168.1.50'], FPGAType: ['Trenz'], HVResource: 'ASRL/dev/ttyUSB0::INSTR', DAQClientService: 'daq-client',
+          AirControlSerialID: 'usb-FTDI_FT232R_USB_UART_AC0090JP-if00-port'}
+      B: {FPGAHostname: ['192.168.1.51'], FPGAType: ['Kria'], HVResource: 'ASRL/dev/ttyUSB2::INSTR', DAQClientService: 'daq-client-b',
+          AirControlSerialID: 'usb-FTDI_FT232R_USB_UART_AC0091KQ-if00-port'}
+
+Only the name of the DAQ client service is set here; each station's service must be set up on the testing PC with its
+own client port. With an RH sensor, every station reads the sensor of its own box through its own Arduino
+(`AirControlSerialID`, see AirControl.py): the sensor sends each line once, so two processes reading one port would
+each get part of the samples, and launch() refuses stations which share one. The dry air relay is switched by the
+same Arduino, so each station also dries its own box.
+
+Each station runs its own copy of the GUI, with its own state, test stand, power supply, and PC client:
+
+    python3 Station.py          starts a GUI for every station
+    python3 Station.py A B      starts GUIs for the named stations
+
+The station of a GUI process is given by the HGCAL_STATION environment variable, which this script sets. Every module
+applies the station's values when it loads the configuration. The GUI waits on the user in modal windows, so stations
+run as separate processes rather than as panels of one window.
+-----------------------------------------------------
+"""
+
+def station_name():
+    """Returns the name of the station this process runs, or None for the usual single-station GUI
+    """
+    return os.environ.get('HGCAL_STATION', None)
+
+def station_configuration(configuration):
+    """
+    Applies the values of the current station, if there is one, on top of the configuration dictionary and returns it.
+    Also sets `StationName` (None without a station).
+    """
+
+    name = station_name()
+    configuration['StationName'] = name
+    if name is None:
+        return configuration
+
+    if 'Stations' not in configuration.keys() or name not in configuration['Stations'].keys():
+        raise KeyError(f'station {name} is not listed under Stations in configuration.yaml')
+    configuration.update(configuration['Stations'][name])
+    return configuration
+
+def launch(names=None):
+    """
+    Starts one GUI process per station and waits for all of them to exit.
+    """
+
+    configuration = {}
+    with open('configuration.yaml', 'r') as file:
+        configuration = yaml.safe_load(file)
+
+    if 'Stations' not in configuration.keys():
+        raise KeyError('no Stations in configuration.yaml')
+    if names is None or len(names) == 0:
+        names = list(configuration['Stations'].keys())
+
+    sensors = {}
+    for name in names:
+        if name not in configuration['Stations'].keys():
+            raise KeyError(f'station {name} is not listed under Stations in configuration.yaml')
+        values = dict(configuration, **configuration['Stations'][name])
+        if values['HasRHSensor']:
+            sensor = values['AirControlSerialID'] if 'AirControlSerialID' in values.keys() else None
+            if sensor in sensors.keys():
+                raise ValueError(f'stations {sensors[sensor]} and {name} read the same RH sensor; set AirControlSerialID for each station')
+            sensors[sensor] = name
+
+    procs = []
+    for name in names:
+        print(f' >> Station: starting GUI for station {name}')
+        env = dict(os.environ, HGCAL_STATION=str(name))
+        procs.append(subprocess.Popen([sys.executable, 'TestingGUIBase.py'], env=env))
+
+    for proc in procs:
+        proc.wait()
+
+if __name__ == '__main__':
+    launch(sys.argv[1:])
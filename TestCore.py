@@ -0,0 +1,973 @@
+from TestStandManager import TestStandManager
+from Timing import span, end_trace, session_summary
+from time import sleep, time
+import os
+import re
+import sys
+import subprocess
+import traceback
+import threading
+import queue
+from datetime import datetime, timedelta
+
+# numpy, matplotlib, pyvisa, paramiko, and the database and hexmap code are imported by the functions below that use
+# them, so importing this module (and opening the GUI) stays fast
+from Configuration import configuration
+
+# pool of connected test stands, reused across modules while the FPGA stays up
+teststands = TestStandManager()
+
+"""
+-------------------TestCore.py-----------------
+
+The hardware and test orchestration behind the GUI: bringing up and shutting down the test system, running the
+testing scripts, taking IV curves, and uploading the results. Nothing here opens a window. Everything that needs a
+person or a screen goes through the operator stored in the `state` dictionary under the field 'operator', which
+provides:
+    - confirm(instruction, button, title=None): returns once the instruction has been carried out
+    - busy(message, title=None, description=None): shows that something is running; returns an object with close()
+    - error(message, title=None): reports an error which ends the session
+    - resume(message): returns 'RESUME' or 'RESTART' for an interrupted measurement
+    - ask_RH_T(): returns the RH and temperature in the box when there is no sensor
+    - progress(message, title=None, description=None, button=...): shows a long-running step which can be stopped;
+        returns an object with wait(timeout=None, proc=None), update(text, stopping=False), close(), point(row)
+        for IV curves, and fail(message), which reports an error from a worker thread.
+        wait() returns True if the step should stop, otherwise once the script proc has exited or after timeout seconds
+    - iv_progress(maxV, history): a progress object for an IV curve, history being the points already taken
+    - show(paths): shows plots to the user
+    - led(field, color): shows the new value of a state field which has a status LED
+    - lid(closed): called from the interlock monitor's thread when the dark box is opened or closed
+
+The GUI's operator (WindowOperator in InteractionGUI.py) opens a window for each of these. PlanOperator below runs
+without a screen for TestRunner.py: confirmations are pre-acknowledged in a plan file and stopping is done with Ctrl-C.
+-----------------------------------------------------
+"""
+
+class PlanOperator:
+    """
+    Operator for running without a screen. Takes the plan dictionary of TestRunner.py, of which it uses:
+        - `acknowledge`: 'all', or the list of instructions (as shown in the GUI) that are done before starting; the
+          cable colours some MACs add in brackets (e.g. "(blue)") may be left out
+        - `resume`: whether to resume interrupted measurements (default false)
+        - `RH`, `Temp`: the box humidity and temperature to record when there is no RH sensor
+    An instruction that is not acknowledged is asked for on the terminal if there is one, and otherwise raises
+    RuntimeError so an unattended run stops instead of skipping a manual step.
+    """
+
+    def __init__(self, plan):
+
+        self.acknowledge = plan.get('acknowledge', [])
+        self.resume_runs = plan.get('resume', False)
+        self.RH = plan.get('RH', None)
+        self.Temp = plan.get('Temp', None)
+
+    def _ask(self, question):
+        if not sys.stdin.isatty():
+            raise RuntimeError(f'"{question}" is not acknowledged in the plan and there is no terminal to ask on')
+        return input(f' ?? TestCore: {question} ')
+
+    def _acknowledged(self, instruction):
+        if self.acknowledge == 'all':
+            return True
+        plain = lambda text: re.sub(r' \([a-z]+\)$', '', text)
+        return plain(instruction) in [plain(done) for done in self.acknowledge]
+
+    def confirm(self, instruction, button, title=None):
+        if self._acknowledged(instruction):
+            print(f' >> TestCore: acknowledged: {instruction}')
+            return 'CONT'
+        self._ask(f'{instruction}, then press Enter ({button})')
+        return 'CONT'
+
+    def busy(self, message, title=None, description=None):
+        print(f' >> TestCore: {message}' + (f' ({description})' if description is not None else ''))
+        return PlanProgress()
+
+    def error(self, message, title=None):
+        print(f' -- TestCore: {message}')
+
+    def resume(self, message):
+        print(f' >> TestCore: {message}: ' + ('resuming' if self.resume_runs else 'starting over'))
+        return 'RESUME' if self.resume_runs else 'RESTART'
+
+    def ask_RH_T(self):
+        if self.RH is not None and self.Temp is not None:
+            return self.RH, self.Temp
+        return self._ask('Enter current humidity (%):'), self._ask('Enter current temperature (deg C):')
+
+    def progress(self, message, title=None, description=None, button=None):
+        print(f' >> TestCore: {message}' + (f' ({description})' if description is not None else ''))
+        return PlanProgress()
+
+    def iv_progress(self, maxV, history):
+        print(f' >> TestCore: taking IV curve to {maxV} V' + (f', {len(history)} points already taken' if len(history) > 0 else ''))
+        return PlanProgress(points=True)
+
+    def show(self, paths):
+        for path in paths:
+            print(f' >> TestCore: plot saved to {path}')
+
+    def led(self, field, color):
+        pass
+
+    def lid(self, closed):
+        pass # the monitor already prints the change
+
+class PlanProgress:
+    """
+    Progress of a long-running step without a screen. Ctrl-C asks the step to stop.
+    """
+
+    def __init__(self, points=False):
+        self.points = points
+
+    def wait(self, timeout=None, proc=None):
+        try:
+            if proc is not None:
+                try:
+                    proc.proc.wait(timeout=timeout)
+                except subprocess.TimeoutExpired:
+                    pass
+            else:
+                sleep(timeout)
+        except KeyboardInterrupt:
+            return True
+        return False
+
+    def update(self, text, stopping=False):
+        print(f' >> TestCore: {text}')
+
+    def point(self, row):
+        if self.points:
+            print(f' >> TestCore: {row[0]} V: {round(row[2]*1e6, 4)} uA')
+
+    def fail(self, message):
+        print(f' -- TestCore: {message}')
+
+    def close(self):
+        pass
+
+def update_state(state, field, val, color=None):
+    """
+    Safely modifies a field of the state dictionary. If that field has an LED, update the color
+    """
+
+    state[field] = val
+    if field[0] == '-' and color is not None:
+        state['operator'].led(field, color)
+
+def end_session(state):
+    """
+    Ends the testing session. The state of the testing system is contained in the `state` dictionary; this
+    function uses those flags to tell the user what must be done (and in what order) to safely shut down the
+    system. In general, shutting it down broadly follows five steps:
+        - Disabling the HV power
+        - De-powering the DCDC or Low Voltage Supply
+        - Shutting down the FPGA
+        - De-powering the FPGA
+        - Disconnecting all of the parts and the module
+    At the end, prints where the time of the session went (see Timing.py).
+    """
+
+    op = state['operator']
+
+    # read density and shape from module serial
+    density = state['-Module-Serial-'].split('-')[1][1]
+    shape = state['-Module-Serial-'].split('-')[2][0]
+    if density == 'L':
+        if shape not in ['F', 'L', 'R', 'T', 'B', '5']:
+            raise NotImplementedError
+    elif density == 'H':
+        if shape not in ['F', 'B', 'L', 'T', 'R']:
+            raise NotImplementedError
+    # enabled for all because nothing in this function is shape or geometry dependent
+    # beside dcdc for LF
+
+    ending = op.busy("Ending session...")
+    sleep(2)
+
+    # First disable HV if it's on
+    # This part assumes the 'ps' is instantiated; a reasonable assumption if the HV output is on
+    if state['-HV-Output-On-']:
+        state['ps'].outputOff()
+        update_state(state, '-HV-Output-On-', False, 'black')
+
+    if state['ps'] is not None and type(state['ps']) != int:
+        print(' >> TestCore: bias voltage ramping this session:', state['ps'].ramp_summary())
+
+    if state['pc'] is not None and type(state['pc']) != int:
+        state['pc'].close()
+
+    # De-power and disconnect the DCDC/LV Power and Hexacontroller
+    # Have to nest these steps because of shutdown order
+    if state['-DCDC-Connected-']:
+        if state['-DCDC-Powered-']:
+
+            command = "Disconnect DCDC power"+(" (green)" if configuration['MACSerial'] == 'CM' else '') if density+shape == 'LF' else "Turn off low voltage power"
+            button = "Depowered"
+            op.confirm(command, button)
+            update_state(state, '-DCDC-Powered-', False, 'black')
+
+            if state['-Hexactrl-Connected-']:
+                if state['-Hexactrl-Powered-']:
+                    if state['-Hexactrl-Accessed-']:
+                        shutdown = op.busy("Shutting down hexacontroller...")
+                        if not state['-Debug-Mode-']:
+                            print(' >> TestCore: hexacontroller ssh this session:', state['ts'].connection_summary())
+                            state['ts'].shutdown()
+                            teststands.discard(state['ts'].hostname)
+                        sleep(10)
+                        shutdown.close()
+                        update_state(state, '-FW-Loaded-', False, 'black')
+                        update_state(state, '-DAQ-Server-', False, 'black')
+                        update_state(state, '-I2C-Server-', False, 'black')
+                        update_state(state, '-Hexactrl-Accessed-', False, 'black')
+
+                    # new open_box call b/c for the kria have to open box to flip switch
+                    open_box(state)
+
+                    if state['-FPGA-Type-'] == 'Kria':
+                        op.confirm("Turn off Kria hexacontroller power switch", "Switched Off")
+                        update_state(state, '-Hexactrl-Powered-', False, 'black')
+
+                    op.confirm("Disconnect hexacontroller power"+(" (blue)" if configuration['MACSerial'] == 'CM' else ''), "Disconnected")
+                    update_state(state, '-Hexactrl-Powered-', False, 'black')
+
+                open_box(state)
+
+                op.confirm("Disconnect hexacontroller from trophy", "Disconnected")
+                update_state(state, '-Hexactrl-Connected-', False, 'black')
+
+        # Disconnect trophy, looback, and DCDC/LV Cables
+        if state['-Trophy-Connected-']:
+            if density+shape == 'LF':
+                op.confirm("Disconnect loopback", "Disconnected")
+            op.confirm("Disconnect trophy", "Disconnected")
+            update_state(state, '-Trophy-Connected-', False, 'black')
+
+        command = "Disconnect DCDC" if density+shape == 'LF' else "Disconnect low voltage cables"
+        op.confirm(command, "Disconnected")
+        update_state(state, '-DCDC-Connected-', False, 'black')
+
+    # Open the box (function handles if it's already open)
+    open_box(state)
+
+    # Lastly, disconnect the HV cable
+    if state['-HV-Connected-']:
+
+        op.confirm("Disconnect HV cable", "Disconnected")
+        update_state(state, '-HV-Connected-', False, 'black')
+
+    if state['interlock'] is not None:
+        state['interlock'].stop()
+        update_state(state, 'interlock', None)
+
+    sleep(2)
+    ending.close()
+    session_summary(end_trace())
+    return
+
+def box_closed(state):
+    """
+    Returns whether the dark box is closed. With an HV switch, this is the last reading of the interlock monitor
+    started by connect_HV, which needs no serial query; before its first reading, the switch is queried directly.
+    Otherwise, it is the value in the `state` dictionary.
+    """
+
+    if state['interlock'] is not None and state['interlock'].closed is not None:
+        return state['interlock'].closed
+    if state['ps'] is not None and type(state['ps']) != int and configuration['HasHVSwitch']:
+        return state['ps'].switch_state()
+    return state['-Box-Closed-']
+
+def open_close_box(state, close=True):
+    """
+    Handles the opening and closing of the testing dark box. If the interlock monitor is running, waits for it to see
+    the lid move; otherwise, asks the user to confirm. Returns 'CONT' once the lid is in place, or 'TERM' if the user
+    stopped waiting (closed the window, or Ctrl-C without a screen).
+    """
+
+    HVswitch_tripped = box_closed(state)
+
+    if state['-Box-Closed-'] != close or HVswitch_tripped != close:
+        closeopen = 'Close' if close else 'Open'
+        button = 'Closed' if close else 'Opened'
+        if state['-Debug-Mode-'] or configuration['HasHVSwitch'] == False or state['interlock'] is None:
+            state['operator'].confirm(f"{closeopen} lid of dark box", button, title=f"{closeopen} Box")
+            update_state(state, '-Box-Closed-', close, 'green' if close else 'black')
+        else:
+            changelid = state['operator'].progress(f"{closeopen} lid of dark box", title=f"{closeopen} Box", button=None)
+            while box_closed(state) != close:
+                if changelid.wait(timeout=0.2):
+                    changelid.close()
+                    print(f' -- TestCore: stopped waiting for the dark box to be {button.lower()}')
+                    return 'TERM'
+            sleep(2)
+            changelid.close()
+            update_state(state, '-Box-Closed-', close, 'green' if close else 'black')
+    return 'CONT'
+
+def open_box(state):
+    return open_close_box(state, close=False)
+
+def close_box(state):
+    return open_close_box(state, close=True)
+
+def connect_HV(state):
+    """
+    Handles the instantiation of the power supply object and connecting the HV cable. Should only
+    be called if the module is live.
+
+    The power supply object is stored in the `state` dictionary under the field 'ps' for power supply.
+    If in debug mode, the 'ps' field is set to be an integer. This way, other functions can check
+    that this function was run even in debug mode.
+    """
+
+    if not state['-HV-Connected-']:
+        state['operator'].confirm("Connect HV cable to hexaboard", "Connected", title="Connect HV")
+        update_state(state, '-HV-Connected-', True, 'green')
+
+    if state['ps'] is None:
+        keith = state['operator'].busy('Connecting to Keithley...', description=f'Initialize PyVISA Resource {configuration["HVResource"]}')
+        if state['-Debug-Mode-']:
+            sleep(5)
+            ps = 1
+            update_state(state, 'ps', ps)
+        else:
+            from Keithley2410 import Keithley2410, InterlockMonitor
+            try:
+                ps = Keithley2410()
+            except ValueError:
+                # try again if the Keithley has some stored errors
+                # if the errors are still there, don't try again
+                ps = Keithley2410()
+            update_state(state, 'ps', ps)
+            if configuration['HasHVSwitch']:
+                interval = configuration['HVSwitchPollInterval'] if 'HVSwitchPollInterval' in configuration.keys() else 1.
+                update_state(state, 'interlock', InterlockMonitor(ps, interval, on_change=state['operator'].lid))
+        keith.close()
+
+def configure_test_stand(state, fpgahostname):
+    """
+    Guides the user through connecting the various boards and then handles the startup of the testing system. At
+    the moment, it assumes the DCDC has already been connected but is not powered. The FPGA test stand is added to
+    the `state` dictionary under the field 'ts' and the External PC object is added under the field 'pc'. If the objects
+    detect errors in the firmware or services, the function returns 'END' after ending the sesion; if all succeed,
+    it returns 'CONT'.
+    """
+
+    with span('configure_test_stand', module=state['-Module-Serial-'], fpga=fpgahostname):
+        op = state['operator']
+
+        # read density and shape from module serial
+        density = state['-Module-Serial-'].split('-')[1][1]
+        shape = state['-Module-Serial-'].split('-')[2][0]
+        if density == 'L':
+            if shape not in ['F', 'L', 'R', 'T', 'B']:
+                raise NotImplementedError
+        elif density == 'H':
+            if shape not in ['F', 'B', 'T', 'L', 'R']:
+                raise NotImplementedError
+        else:
+            raise NotImplementedError
+
+        op.confirm("Connect trophy board to hexaboard", "Connected", title="Connect Trophy")
+        if density+shape == 'LF':
+            op.confirm("Connect loopback board to hexaboard", "Connected", title="Connect Loopback")
+        update_state(state, '-Trophy-Connected-', True, 'green')
+        op.confirm("Ensure NOTHING is powered", "No power")
+        op.confirm("Connect trophy board and hexacontroller", "Connected", title='Connect Hexacontroller')
+        update_state(state, '-Hexactrl-Connected-', True, 'green')
+
+        op.confirm("Connect hexacontroller power cable"+(" (blue)" if configuration['MACSerial'] == 'CM' else ''), "Powered", title='Power Hexacontroller')
+        update_state(state, '-Hexactrl-Powered-', True, 'green')
+
+        if state['-FPGA-Type-'] == 'Kria':
+            update_state(state, '-Hexactrl-Powered-', False, 'black')
+            op.confirm("Turn on Kria hexacontroller power switch", "Powered", title='Switch On Hexacontroller')
+            update_state(state, '-Hexactrl-Powered-', True, 'green')
+
+        # now have close box after powering on test stand b/c kria has a switch
+        if state['-Live-Module-'] and close_box(state) != 'CONT':
+            end_session(state)
+            return 'END'
+
+        connecting = op.busy("Connecting to hexacontroller...", description=f'ssh root@{fpgahostname}')
+        if state['-Debug-Mode-']:
+            sleep(5)
+            ts = None
+        else:
+            try:
+                ts = teststands.connect(fpgahostname, state['-Module-Serial-'], fpgatype=state['-FPGA-Type-']) # will take some time if the FPGA was just powered
+            except TimeoutError:
+                connecting.close()
+                op.error("Unable to connect to hexacontroller. Exiting...", title="Error in Connection")
+                end_session(state)
+                return 'END'
+        connecting.close()
+        update_state(state, '-Hexactrl-Accessed-', True, 'green')
+        update_state(state, 'ts', ts)
+
+        command = "Connect DCDC power cable"+(" (green)" if configuration['MACSerial'] == 'CM' else "") if density+shape == 'LF' else "Turn on low voltage power"
+        op.confirm(command, "Powered")
+        update_state(state, '-DCDC-Powered-', True, 'green')
+        loading = op.busy("Loading firmware on hexacontroller...", title="Loading Firmware...", description='fw-loader load [firmware] && listdevice')
+        if state['-Debug-Mode-']:
+            sleep(5)
+            fwloaded = True
+        else:
+            fwloaded = state['ts'].loadfw() # skips fw-loader if the firmware is loaded and the ROCs answer in listdevice
+        loading.close()
+        update_state(state, '-FW-Loaded-', fwloaded, 'green' if fwloaded else 'red')
+        if not fwloaded:
+            op.error("Firmware loading error or unable to find ROC channels. Exiting...", title="Error in Firmware")
+            end_session(state)
+            return 'END'
+
+        starting = op.busy("Starting services on test stand...", title="Starting Services...", description='systemctl restart daq-server && systemctl restart i2c-server')
+        if state['-Debug-Mode-']:
+            sleep(5)
+            services = True
+        else:
+            services = state['ts'].startservers() # skips the restart if the firmware was reused and both services are running
+        starting.close()
+        update_state(state, '-DAQ-Server-', services, 'green' if services else 'red')
+        update_state(state, '-I2C-Server-', services, 'green' if services else 'red')
+        if not services:
+            op.error("Error in FPGA services. Exiting...", title="Error in Services")
+            end_session(state)
+            return 'END'
+
+        daq = op.busy("Starting services on PC...", title="Starting Services...", description='systemctl restart daq-client')
+        if state['-Debug-Mode-']:
+            pc = None
+            sleep(5)
+        else:
+            from ExternalPC import ExternalPC
+            try:
+                pc = ExternalPC(fpgahostname, state) # automatically starts daq client
+            except AssertionError:
+                daq.close()
+                op.error("Can't find hexactrl-sw on PC. Exiting...", title="Error on PC")
+                end_session(state)
+                return 'END'
+
+        daq.close()
+        update_state(state, '-DAQ-Client-', True, 'green')
+        update_state(state, 'pc', pc)
+
+        ready = op.busy("Ready to run tests.", title="Ready")
+        sleep(2)
+        ready.close()
+        return 'CONT'
+
+def set_bias(state, BV):
+    """
+    Turns the bias voltage on and sets it to BV if the module is live and BV is given.
+    """
+
+    if state['-Live-Module-'] and BV is not None:
+        if not state['ps'].get_output():
+            state['ps'].outputOn()
+            update_state(state, '-HV-Output-On-', True, 'green')
+        state['ps'].setVoltage(float(BV))
+
+def follow_script(proc, progress, caller):
+    """
+    Waits for a testing script to finish while letting the operator stop it. Returns 'RUN' if the script finished
+    or 'TERM' if the operator stopped it. The script process still has to be ended with end_test().
+    """
+
+    if progress.wait(proc=proc):
+        print(f' >> TestCore: calling TERMINATE on {caller} at operator request')
+        return 'TERM'
+    proc.is_finished() # raises RuntimeError if the script failed
+    return 'RUN'
+
+def run_pedestals(state, BV):
+    """
+    Runs pedestals via the PC and then makes hexmap plots. If the module is live, sets the bias voltage
+    according to the BV argument.
+    """
+
+    status = 'RUN'
+    pedestals = state['operator'].progress(f"Running Pedestals (BV={BV})...", description='python3 pedestal_run.py [options...]')
+
+    if state['-Debug-Mode-']:
+        sleep(5)
+        hexpath = ''
+        status = 'CONT'
+    else:
+        # once the dry air is on, the RH in the box changes from run to run, so each run records its own
+        if 'dry_air_start' in state.keys():
+            from DBTools import add_RH_T
+            add_RH_T(state, force=True)
+
+        set_bias(state, BV)
+
+        proc = state['pc'].pedestal_proc(BV=BV)
+        status = follow_script(proc, pedestals, 'run_pedestals')
+        pedestalpath = proc.end_test()
+        if status == 'RUN':
+            status = 'CONT'
+        del proc
+
+        if state['-Live-Module-'] and BV is not None:
+            _, current, _ = state['ps'].measureCurrentLoop()
+            state['-Leakage-Current-'] = current
+
+        # rename output directory with conditions of test
+        trimmed = 'untrimmed' if '-Pedestals-Trimmed-' not in state.keys() else ('trimmed' if state['-Pedestals-Trimmed-'] == True else f'trimmed{state["-Pedestals-Trimmed-"]}')
+        if BV is not None:
+            testtag = f'BV{BV}_RH{state["-Box-RH-"]}_T{state["-Box-T-"]}_{trimmed}'
+        else:
+            testtag = trimmed
+
+        # rename, but prevent crash if it fails
+        try:
+            os.system(f'mv {pedestalpath} {pedestalpath}_{testtag}')
+        except:
+            print(' -- TestCore: pedestal run renaming failed')
+            print(f'    attempted: mv {pedestalpath} {pedestalpath}_{testtag}')
+
+        if configuration['HasLocalDB'] and status == 'CONT':
+            from DBTools import pedestal_upload, plots_upload
+            try:
+                pedestal_upload(state) # uploads pedestals to database
+            except Exception:
+                print('  -- Pedestal upload exception:', traceback.format_exc())
+
+        if status == 'CONT':
+            hexpath = state['pc'].make_hexmaps(tag=testtag)
+        else:
+            hexpath = ''
+        if configuration['HasLocalDB'] and status == 'CONT':
+            try:
+                plots_upload(state) # uploads pedestal plots to database
+            except Exception:
+                print('  -- Plots upload exception:', traceback.format_exc())
+
+    pedestals.close()
+    return hexpath, status
+
+def multi_run_pedestals(state, BV_list):
+    """
+    Runs multiple pedestal runs. If the module is not live, the argument BV_list is full of Nones.
+    """
+
+    hexpath = ''
+    status = 'CONT'
+    for BV in BV_list:
+        hexpath, status = run_pedestals(state, BV)
+        if status != 'CONT':
+            break
+    if not state['-Debug-Mode-'] and len(BV_list) > 0 and hexpath != '':
+        state['operator'].show([f'{hexpath}_adc_mean.png', f'{hexpath}_adc_stdd.png'])
+
+    return status
+
+def trim_pedestals(state, BV):
+    """
+    Trims the pedestals by running the pedestal run, pedestal scan, and Vref NoInv and Inv scans in sequence, each
+    updating the configuration file for the next. Returns 'CONT', or 'TERM' if stopped by the operator.
+    """
+
+    status = 'RUN'
+    trimming = state['operator'].progress(f"Trimming Pedestals (BV={BV})...", button='Terminate Trimming',
+                                          description='python3 pedestal_run.py [options...] && python3 pedestal_scan.py [options...] &&\npython3 vrefnoinv_scan.py [options...] && python3 vrefinv_scan.py [options...]')
+
+    if state['-Debug-Mode-']:
+        sleep(5)
+        status = 'CONT'
+    else:
+        if state['-Live-Module-'] and BV is not None:
+            state['ps'].outputOn()
+            update_state(state, '-HV-Output-On-', True, 'green')
+            state['ps'].setVoltage(float(BV))
+
+        for script in ['pedestal_run', 'pedestal_scan', 'vrefnoinv_scan', 'vrefinv_scan']:
+            proc = state['pc'].create_proc(script)
+            status = follow_script(proc, trimming, 'trim_pedestals')
+            proc.end_test()
+            del proc
+            if status != 'RUN':
+                break
+
+        if status == 'RUN':
+            status = 'CONT'
+
+        if not status == 'TERM':
+            if state['-Live-Module-'] and BV is not None:
+                _, current, _ = state['ps'].measureCurrentLoop()
+                state['-Leakage-Current-'] = current
+
+            if BV is None:
+                state['-Pedestals-Trimmed-'] = True
+            else:
+                state['-Pedestals-Trimmed-'] = BV
+
+    trimming.close()
+    return status
+
+def run_other_script(script, state, BV):
+    """
+    Runs one of the other testing scripts and uploads its output. Returns 'CONT', or 'TERM' if stopped by the operator.
+    """
+
+    status = 'RUN'
+    scriptrun = state['operator'].progress(f"Running Script {script} (BV={BV})...", description=f'python3 {script}.py [options...]')
+
+    if state['-Debug-Mode-']:
+        sleep(5)
+        status = 'CONT'
+    else:
+        if state['-Live-Module-'] and BV is not None:
+            state['ps'].outputOn()
+            update_state(state, '-HV-Output-On-', True, 'green')
+            state['ps'].setVoltage(float(BV))
+
+        proc = state['pc'].script_proc(script, BV=BV)
+        status = follow_script(proc, scriptrun, 'run_other_script')
+        scriptpath = proc.end_test()
+        if status == 'RUN':
+            status = 'CONT'
+        del proc
+
+        if state['-Live-Module-'] and BV is not None:
+            _, current, _ = state['ps'].measureCurrentLoop()
+            state['-Leakage-Current-'] = current
+
+        if configuration['HasLocalDB'] and status == 'CONT':
+            from DBTools import other_test_upload
+            try:
+                other_test_upload(state, script, BV)
+            except Exception:
+                print('  -- Other test upload exception:', traceback.format_exc())
+
+    scriptrun.close()
+    return status
+
+def take_IV_curve(state, step=10, maxV=900):
+    """
+    Takes an IV curve automatically using the power supply object. The range is assumed to be 0-900V
+    and the default step is 20V. If the RH argument is not zero, it prompts the user to enter the ambient
+    humidity. We intend to query this automatically in the future but do not have the capability at the
+    moment.
+
+    The curve is taken in a worker thread and each point is passed to the operator as it arrives. Stopping ramps the
+    bias voltage back down to 0V and returns 'TERM', also while a point is still settling. An error from the Keithley
+    is reported to the operator as soon as it happens and returns 'END'.
+    """
+
+    from DBTools import add_RH_T, iv_save
+    from IVStreamWriter import IVStreamWriter, find_resumable_stream
+
+    op = state['operator']
+    connect_HV(state) # will do nothing if already connected
+    RH, Temp = add_RH_T(state, force=True) # also adds RH,T to state dict
+
+    if state['-Debug-Mode-']:
+        curvew = op.busy(f'Taking IV curve...')
+        sleep(5)
+        curvew.close()
+        return 'CONT'
+
+    if configuration['HasHVSwitch'] and not box_closed(state):
+        print(' >> HV switch not tripped - exiting. Please close box and try again.')
+        return 'END'
+
+    if configuration['HVWiresPolarization'] == 'Forward':
+        maxV = -maxV
+        step = -step
+
+    # every point is streamed to disk as it is taken; offer to pick up an interrupted curve where it stopped
+    outdir = f'{configuration["DataLoc"]}/{state["-Output-Subdir-"]}'
+    streampath = find_resumable_stream(outdir, state['-Module-Serial-'], maxV, step)
+    if streampath is not None:
+        if op.resume(f'Found interrupted IV curve {os.path.basename(streampath)}') != 'RESUME':
+            streampath = None
+    if streampath is None:
+        now = datetime.now().isoformat()
+        streampath = f'{outdir}/{state["-Module-Serial-"]}_IVstream_{now.split("T")[0]}_{now.split("T")[1].split(".")[0]}.csv'
+    stream = IVStreamWriter(streampath, maxV=maxV, stepV=step, RH=RH, Temp=Temp)
+
+    curvew = op.iv_progress(maxV, stream.data().tolist())
+
+    # IV curve is run in a worker thread so the operator stays responsive; points are passed back through a queue
+    points = queue.Queue()
+    abort = threading.Event()
+    result = {}
+    def worker():
+        try:
+            result['curve'] = state['ps'].takeIVnew(maxV, step, RH, Temp, stream=stream, progress=points, abort=abort) # IV curve is stored in the ps object so all curves can be plotted together
+        except Exception as e:
+            result['error'] = traceback.format_exc()
+            curvew.fail(f'Error from the Keithley: {e}')
+    thread = threading.Thread(target=worker, daemon=True)
+
+    update_state(state, '-HV-Output-On-', True, 'green')
+    thread.start()
+
+    while thread.is_alive() or not points.empty():
+        if curvew.wait(timeout=0.2) and not abort.is_set():
+            print(' >> TestCore: aborting IV curve at operator request, ramping down')
+            abort.set()
+            curvew.update('Aborting, ramping bias voltage down...', stopping=True)
+        while not points.empty():
+            curvew.point(points.get())
+    thread.join()
+
+    update_state(state, '-HV-Output-On-', False, 'black')
+    curvew.close()
+
+    if 'error' in result:
+        print('  -- IV curve exception:', result['error'])
+        # make sure the bias is down if the worker died partway through
+        state['ps'].setVoltage(0.)
+        state['ps'].outputOff()
+        op.error("Error while taking IV curve. Exiting...", title="Error in IV Curve")
+        return 'END'
+
+    curve = result['curve']
+    if curve is None:
+        return 'TERM'
+
+    if configuration['HasLocalDB']:
+        from DBTools import iv_upload
+        try:
+            iv_upload(curve, state) # saves IV curve as pickle object and uploads to local db
+        except Exception:
+            print('  -- IV upload exception:', traceback.format_exc())
+    else:
+        iv_save(curve, state) # saves IV curve as pickle object
+    return 'CONT'
+
+def restart_services(state):
+    """
+    Restarts and checks the status of the DAQ Server, I2C Server, and DAQ Client services. It also
+    updates the status LEDs accordingly.
+    """
+
+    if not (state['-DCDC-Connected-'] and state['-DCDC-Powered-'] and state['-Hexactrl-Powered-'] and state['-Hexactrl-Accessed-'] and state['-FW-Loaded-']):
+        return
+
+    starting = state['operator'].busy("Restarting services on test stand...", title="Starting Services...", description='systemctl restart daq-server && systemctl restart i2c-server')
+    if state['-Debug-Mode-']:
+        sleep(5)
+        services = True
+    else:
+        services = state['ts'].startservers(force=True)
+    starting.close()
+    update_state(state, '-DAQ-Server-', services, 'green' if services else 'black')
+    update_state(state, '-I2C-Server-', services, 'green' if services else 'black')
+
+    daq = state['operator'].busy("Starting services on PC...", title="Starting Services...", description='systemctl restart daq-client')
+    if state['-Debug-Mode-']:
+        sleep(1)
+        service = True
+    else:
+        service = state['pc'].restart_daq()
+    daq.close()
+    update_state(state, '-DAQ-Client-', service, 'green' if service else 'black')
+
+    if not state['-Debug-Mode-']:
+        state['pc'].initiated = False
+
+def open_dry_air(state):
+    """
+    Opens the dry air valve, automatically if the box has the RH sensor and air control, otherwise by asking the user.
+    """
+
+    if not configuration['HasRHSensor'] or state['-Debug-Mode-']:
+        state['operator'].confirm('Open dry air valve', 'Open')
+    else:
+        from AirControl import get_sampler
+        ac = get_sampler().controller
+        for i in range(10):
+            ac.set_air_on()
+    state['dry_air_start'] = time()
+
+def dry_wait(state, seconds, bias=None):
+    """
+    Waits for the dry air to flush the box, showing when the wait will end and letting the user terminate it. If bias
+    is given and the module is live, the module is held at that bias voltage while waiting. Returns 'CONT' or 'TERM'.
+    """
+
+    if bias is not None and state['-Live-Module-'] and not state['-Debug-Mode-']:
+        state['ps'].outputOn()
+        update_state(state, '-HV-Output-On-', True, 'green')
+        state['ps'].setVoltage(float(bias))
+
+    finalIV_date = datetime.now() + timedelta(seconds=seconds)
+    finalIV_time = finalIV_date.isoformat().split('T')[1].split('.')[0]
+
+    waiting = state['operator'].progress(f"Waiting until {finalIV_time} to perform IV", title="Waiting for Dry IV")
+
+    status = 'CONT'
+    while datetime.now() < finalIV_date:
+        if waiting.wait(timeout=min(1., max((finalIV_date - datetime.now()).total_seconds(), 0.))):
+            print(' >> TestCore: calling TERMINATE while waiting for dry IV at operator request')
+            status = 'TERM'
+            break
+
+    waiting.close()
+    return status
+
+def wait_for_dry(state, rh_below=None, timeout=None, fallback=None, bias=None, hold=None, stale=10.):
+    """
+    Waits until the box is dry enough for a dry IV curve. With an RH sensor, checks the samples of the shared
+    AirControl sampler every couple of seconds and returns once the samples have stayed below rh_below percent for hold
+    seconds, or 'END' if that has not happened after timeout seconds. The hold is measured between sampler timestamps,
+    and restarts if no new sample arrives for stale seconds. Every sample is logged to a csv file in the test
+    output directory so the thresholds can be tuned. Without a sensor, waits until fallback seconds after the dry air
+    was opened. Unset arguments use the DryRHThreshold, DryRHHold, and DryRHTimeout configuration values. If bias is
+    given and the module is live, the module is held at that bias voltage while waiting. Returns 'CONT', 'TERM', or
+    'END'.
+    """
+
+    if rh_below is None:
+        rh_below = configuration['DryRHThreshold'] if 'DryRHThreshold' in configuration.keys() else 5
+    if hold is None:
+        hold = configuration['DryRHHold'] if 'DryRHHold' in configuration.keys() else 60
+    if timeout is None:
+        timeout = 60*(configuration['DryRHTimeout'] if 'DryRHTimeout' in configuration.keys() else 30)
+    if fallback is None:
+        fallback = timeout
+
+    if not configuration['HasRHSensor'] or state['-Debug-Mode-']:
+        opened = state['dry_air_start'] if 'dry_air_start' in state.keys() else time()
+        return dry_wait(state, max(fallback - (time() - opened), 0.01), bias=bias)
+
+    if bias is not None and state['-Live-Module-']:
+        state['ps'].outputOn()
+        update_state(state, '-HV-Output-On-', True, 'green')
+        state['ps'].setVoltage(float(bias))
+
+    from AirControl import get_sampler
+    sampler = get_sampler()
+
+    logpath = f'{configuration["DataLoc"]}/{state["-Output-Subdir-"]}/{state["-Module-Serial-"]}_RHdecay_{datetime.now().strftime("%Y%m%d_%H%M%S")}.csv'
+    log = open(logpath, 'w')
+    log.write(f'# threshold={rh_below}\n# hold={hold}\n# timeout={timeout}\n')
+    if 'dry_air_start' in state.keys():
+        log.write(f'# air_on={datetime.fromtimestamp(state["dry_air_start"]).isoformat()}\n')
+    log.write('elapsed_s,RH,Temp\n')
+
+    waiting = state['operator'].progress(f"Waiting for RH below {rh_below}% for {hold}s to perform IV", title="Waiting for Dry IV")
+    print(f' >> TestCore: waiting for RH below {rh_below}% for {hold}s to perform IV, logging to {logpath}')
+
+    start = time()
+    logged = start
+    below_since = None
+    RH = None
+    status = 'CONT'
+    while True:
+        if waiting.wait(timeout=2.):
+            print(' >> TestCore: calling TERMINATE while waiting for dry IV at operator request')
+            status = 'TERM'
+            break
+
+        # every sample the sampler took since the last check, so the log has the full decay curve
+        for timestamp, RH, Temp in sampler.series(since=logged):
+            log.write(f'{round(timestamp - start, 1)},{RH},{Temp}\n')
+            below_since = (below_since if below_since is not None else timestamp) if RH < rh_below else None
+            logged = timestamp
+        log.flush()
+
+        # a sensor which stopped sending doesn't show the box is dry
+        if time() - logged > stale:
+            below_since = None
+
+        elapsed = time() - start
+        if RH is not None:
+            waiting.update(f'RH: {RH}% after {int(elapsed)}s' + (f', below for {int(logged - below_since)}s' if below_since is not None else '')
+                           + (f', no sample for {int(time() - logged)}s' if time() - logged > stale else ''))
+            if below_since is not None and logged - below_since >= hold:
+                print(f' >> TestCore: RH {RH}% and below {rh_below}% for {int(logged - below_since)}s after {round(elapsed)}s, starting IV')
+                break
+        if elapsed > timeout:
+            print(f' -- TestCore: RH still {RH}% after {timeout}s, ending test')
+            status = 'END'
+            break
+
+    waiting.close()
+    log.close()
+    return status
+
+def check_services(state):
+    """
+    Checks the status of the services and updates the status LEDs accordingly.
+    """
+
+    checking = state['operator'].busy("Checking status of services...", title="Checking Services...")
+
+    if state['-Debug-Mode-']:
+        update_state(state, '-DAQ-Server-', True, 'green')
+        update_state(state, '-I2C-Server-', True, 'green')
+        update_state(state, '-DAQ-Client-', True, 'green')
+    else:
+
+        daq_server, i2c_server = state['ts'].statusservers()
+        update_state(state, '-DAQ-Server-', daq_server, 'green' if daq_server else 'red')
+        update_state(state, '-I2C-Server-', i2c_server, 'green' if i2c_server else 'red')
+
+        daq_client = state['pc'].status_daq()
+        update_state(state, '-DAQ-Client-', daq_client, 'green' if daq_client else 'red')
+
+    checking.close()
+
+def plot_IV_curves(state):
+    """
+    Plots all IV curves taken during this session. These curves are stored in the IVdata field of the
+    power supply object.
+    """
+
+    if state['-Debug-Mode-']:
+        pass
+    else:
+        import numpy as np
+        import matplotlib as mpl
+        import matplotlib.pyplot as plt
+        mpl.rcParams.update(mpl.rcParamsDefault)
+        mpl.rc("font", size=20)
+
+        fig, ax = plt.subplots(figsize=(16, 12))
+        for datadict in state['ps'].IVdata:
+            data = datadict['data']
+            plt.plot(data[:,1], data[:,2], 'o-', label=f"{datadict['RH']}% RH; {datadict['Temp']}ºC")
+
+        outdir = state['-Output-Subdir-']
+
+        ax.set_yscale('log')
+        ax.set_title(f'{state["-Module-Serial-"]} module IV Curve Set {datadict["date"]}')
+        ax.set_xlabel('Bias Voltage [V]')
+        ax.set_ylabel(r'Leakage Current [A]')
+        ax.set_ylim(1e-9, 1e-03)
+        ax.set_xlim(0, 900)
+        ax.legend()
+
+        # add grading info to plot
+        try:
+            v = data[:,0]
+            i600 = data[np.argwhere(v==600.),2]*10**6
+            i850600 = data[np.argwhere(v==850.),2]/data[np.argwhere(v==600.),2]
+            grade = 'A' if (i600 < 100. and i850600 < 2.5) else ('B' if (i600 < 200. and i850600 < 5.) else 'C')
+            ax.text(850, 1e-8, f'IV Grade (last curve): {grade}', ha='right', va='center')
+            ax.text(850, 5e-9, f'I(600V) = {round(data[60,2]*10**6, 2)} $\mu$A', ha='right', va='center')
+            ax.text(850, 2.5e-9, f'I(850V)/I(600V) = {round(data[85,2]/data[60,2], 3)}', ha='right', va='center')
+        except Exception:
+            print("  -- TestCore: can't add grading info to IV plot;", traceback.format_exc())
+
+        # dynamically name file to avoid overwriting plots
+        filepath = f'{configuration["DataLoc"]}/{outdir}/{state["-Module-Serial-"]}_IVset_{datadict["date"]}'
+        filepath += '{}.png'
+        end = '_0'
+        thisend = int(end[1])
+        while os.path.isfile(filepath.format(end)):
+            end = '_{}'.format(thisend)
+            thisend += 1
+
+        plt.savefig(filepath.format(end))
+
+        plt.close(fig)
+        state['operator'].show([filepath.format(end)])
@@ -0,0 +1,154 @@
+import os
+import sys
+from argparse import ArgumentParser
+from datetime import datetime
+from time import time
+from TestCore import (PlanOperator, configure_test_stand, connect_HV, close_box, check_services, end_session,
+                      update_state)
+from Timing import end_trace, session_summary
+from TestSequence import TestSequence
+
+import yaml
+from Configuration import configuration
+
+"""
+-------------------TestRunner.py-----------------
+
+Runs a test sequence without the GUI, e.g. overnight or for repeated hexaboard pedestal runs:
+
+    python3 TestRunner.py session.yaml [--debug]
+
+The session file describes the module and what to run (see test_plans/headless_hexaboard_burnin.yaml):
+    - `module`: serial number of the module or hexaboard; `live`: true for live modules
+    - `fpga`: hostname of the hexacontroller (defaults to the first FPGAHostname)
+    - `status`, `tag`, `inspector`: as entered in the GUI; the output goes to DataLoc/module/status_date/tag
+    - `sequence`: test plan to run (see TestSequence.py), `repeat` times in a row (default 1)
+    - `first`: optional test plan to run once before them, e.g. to trim the pedestals
+    - `acknowledge`: the manual steps which are done before starting, as their instruction text in the GUI
+        (any cable colour in brackets may be left out), or 'all'
+    - `resume`, `RH`, `Temp`: see PlanOperator in TestCore.py
+    - `debug`: run in debug mode (also set by --debug)
+    - `end_session`: whether to shut the system down at the end (default true); the shutdown steps must be
+        acknowledged too
+
+The test system is brought up with the same steps as the GUI's Configure Test Stand, without the initial checks of
+the module. Ctrl-C stops the running step and then shuts down.
+-----------------------------------------------------
+"""
+
+ledlist = ['-Debug-Mode-', '-Live-Module-', '-HV-Connected-', '-Box-Closed-', '-HV-Output-On-', '-DCDC-Connected-', '-DCDC-Powered-', '-Trophy-Connected-',
+           '-Hexactrl-Connected-', '-Hexactrl-Powered-', '-Hexactrl-Accessed-', '-FW-Loaded-', '-DAQ-Server-', '-I2C-Server-', '-DAQ-Client-' ]
+
+def init_state(plan, debug):
+    """
+    Returns a state dictionary like the GUI's for the module in the plan, with the PlanOperator and no main window.
+    """
+
+    state = {led: False for led in ledlist}
+    state['-Live-Module-'] = plan.get('live', False)
+    state['-Debug-Mode-'] = debug
+    state['-Skip-Checks-'] = True
+    state['ts'] = None
+    state['pc'] = None
+    state['ps'] = None
+    state['interlock'] = None
+    state['basewindow'] = None
+    state['operator'] = PlanOperator(plan)
+    state['-Module-Serial-'] = plan['module']
+    state['-Inspector-'] = plan.get('inspector', '')
+    state['-Module-Status-'] = plan.get('status', '')
+
+    fpga = plan.get('fpga', configuration['FPGAHostname'][0])
+    state['-FPGA-Type-'] = dict(zip(configuration['FPGAHostname'], configuration['FPGAType']))[fpga]
+    return state, fpga
+
+def set_output(state, plan):
+    """
+    Sets and creates the output directory the same way the GUI does when running tests.
+    """
+
+    date = datetime.now().isoformat().split('T')[0]
+    status = state['-Module-Status-'].replace(' ', '_')
+    tag = str(plan.get('tag', '')).replace(' ', '_')
+    state['-Output-Subdir-'] = f'{state["-Module-Serial-"]}/{status}_{date}' + (f'/{tag}' if tag != '' else '')
+    if not state['-Debug-Mode-']:
+        os.makedirs(f'{configuration["DataLoc"]}/{state["-Output-Subdir-"]}', exist_ok=True)
+    print(f' >> TestRunner: will send test output to {state["-Output-Subdir-"]}')
+    state['tests_start'] = time()
+    if state['pc'] is not None:
+        state['pc'].init_outdir(state['-Output-Subdir-'])
+
+def run(plan, debug):
+    """
+    Brings up the test system, runs the sequence the requested number of times, and shuts the system down. Returns
+    the status of the last sequence.
+    """
+
+    state, fpga = init_state(plan, debug)
+    if configure_test_stand(state, fpga) != 'CONT':
+        return 'END' # configure_test_stand has already ended the session
+
+    status = 'END'
+    times = []
+    try:
+        if state['-Live-Module-']:
+            connect_HV(state)
+            if close_box(state) != 'CONT':
+                return 'TERM'
+
+        set_output(state, plan)
+        check_services(state)
+        if not (state['-DAQ-Server-'] and state['-I2C-Server-'] and state['-DAQ-Client-']):
+            print(' -- TestRunner: services not running, not starting tests')
+            return 'END'
+        from DBTools import add_RH_T # numpy, pandas, and the database code, only once the tests start
+        add_RH_T(state)
+
+        if 'first' in plan.keys():
+            print(f' >> TestRunner: running {plan["first"]} first')
+            status = TestSequence(plan['first'], state).run()
+            if status != 'CONT':
+                return status
+
+        for i in range(plan.get('repeat', 1)):
+            print(f' >> TestRunner: {plan["sequence"]} run {i+1} of {plan.get("repeat", 1)}')
+            start = time()
+            status = TestSequence(plan['sequence'], state).run()
+            times.append(time() - start)
+            if status != 'CONT':
+                break
+
+    except KeyboardInterrupt:
+        print(' -- TestRunner: interrupted, shutting down')
+        status = 'TERM'
+
+    finally:
+        if state['-HV-Output-On-'] and not state['-Debug-Mode-']:
+            state['ps'].outputOff()
+            update_state(state, '-HV-Output-On-', False, 'black')
+        if len(times) > 0:
+            print(f' >> TestRunner: {len(times)} runs of {plan["sequence"]}, ' + ', '.join([f'{round(t, 1)}s' for t in times]))
+        if plan.get('end_session', True):
+            end_session(state)
+            if configuration['HasRHSensor'] and not state['-Debug-Mode-']:
+                from AirControl import get_sampler
+                ac = get_sampler().controller
+                for i in range(10):
+                    ac.set_air_off()
+        else:
+            session_summary(end_trace()) # end_session prints it otherwise
+
+    return status
+
+if __name__ == '__main__':
+
+    parser = ArgumentParser()
+    parser.add_argument('session', help='session file describing the module and the sequence to run')
+    parser.add_argument('--debug', action='store_true', help='run in debug mode, without talking to the test stand')
+    args = parser.parse_args()
+
+    with open(args.session, 'r') as file:
+        plan = yaml.safe_load(file)
+
+    status = run(plan, args.debug or plan.get('debug', False))
+    sys.exit(0 if status == 'CONT' else 1)
@@ -0,0 +1,324 @@
+import os
+import json
+import shutil
+from time import time
+from datetime import datetime
+from TestCore import (trim_pedestals, multi_run_pedestals, take_IV_curve, plot_IV_curves, check_services, update_state,
+                      open_dry_air, dry_wait, wait_for_dry)
+
+import yaml
+from Configuration import configuration
+
+"""
+-------------------TestSequence.py-----------------
+
+Runs a sequence of tests described by a test plan in YAML (see the files in test_plans/). A plan is a list of steps,
+each with an `id` and an `action`, plus:
+    - `after`: ids of the steps that must be done before this one
+    - `bias`: bias voltage for the step (a list for `pedestals`, one run per entry); ignored for hexaboards
+    - `runs`: number of pedestal runs when there is no bias list (hexaboards)
+    - `air`: 'ambient' or 'dry', the air the step must be taken in
+    - `requires`: preconditions checked right before the step runs:
+        `services: true` (test stand and PC services up), `hv: off` (bias output off), and
+        `rh_below: <percent>` with optional `rh_timeout: <minutes>` (default 30; only checked with an RH sensor, in a
+        window which can stop the sequence)
+
+The `wait` action waits `minutes`; `dry_until` waits until the RH has stayed below `rh_below` for `hold` seconds
+(giving up after `timeout` minutes), or without an RH sensor until `minutes` after the `dry_air` step opened the valve.
+Unset thresholds use the DryRH* configuration values.
+
+Steps may run in any order that respects `after`. The order is chosen to keep all ambient-air steps before the dry
+air is turned on and to change the bias voltage as little as possible between steps; ties keep the plan order.
+
+After each step, the completed steps, their wall times, and a copy of the (possibly trimmed) configuration are written
+to a checkpoint next to the test output, so a sequence interrupted by a crash can be resumed from where it stopped.
+-----------------------------------------------------
+"""
+
+class TestStep:
+    """
+    One step of a test plan.
+    """
+
+    def __init__(self, index, spec):
+
+        self.index = index
+        self.id = spec['id']
+        self.action = spec['action']
+        self.after = spec.get('after', [])
+        self.bias = spec.get('bias', None)
+        self.runs = spec.get('runs', None)
+        self.air = spec.get('air', None)
+        self.minutes = spec.get('minutes', None)
+        self.rh_below = spec.get('rh_below', None)
+        self.timeout = spec.get('timeout', None)
+        self.hold = spec.get('hold', None)
+        self.maxV = spec.get('maxV', 900)
+        self.stepV = spec.get('stepV', 10)
+        self.requires = spec.get('requires', {})
+
+        if self.action not in actions.keys():
+            raise ValueError(f'unknown action {self.action} in step {self.id}')
+
+    def bias_range(self):
+        """
+        Returns the bias voltage at the start and the end of this step, with 0 meaning the output is off.
+        """
+
+        if self.action == 'iv' or self.requires.get('hv', None) == 'off':
+            start = 0.
+        elif isinstance(self.bias, list) and len(self.bias) > 0:
+            start = float(self.bias[0])
+        elif self.bias is not None:
+            start = float(self.bias)
+        else:
+            start = None
+
+        if self.action in ['iv', 'hv_off']:
+            end = 0.
+        elif isinstance(self.bias, list) and len(self.bias) > 0:
+            end = float(self.bias[-1])
+        elif self.bias is not None:
+            end = float(self.bias)
+        else:
+            end = None
+        return start, end
+
+class TestSequence:
+    """
+    Loads a test plan and runs its steps on the module described by the state dictionary.
+    """
+
+    def __init__(self, planfile, state):
+
+        with open(planfile, 'r') as file:
+            plan = yaml.safe_load(file)
+
+        self.name = plan['name']
+        self.state = state
+        self.steps = {}
+        for index, spec in enumerate(plan['steps']):
+            step = TestStep(index, spec)
+            if step.id in self.steps.keys():
+                raise ValueError(f'step {step.id} appears twice in {planfile}')
+            self.steps[step.id] = step
+
+        for step in self.steps.values():
+            for dep in step.after:
+                if dep not in self.steps.keys():
+                    raise ValueError(f'step {step.id} depends on unknown step {dep}')
+        self.order() # raises ValueError if the steps have a cycle
+
+        self.outdir = f'{configuration["DataLoc"]}/{state["-Output-Subdir-"]}'
+        self.checkpointpath = f'{self.outdir}/sequence_{self.name}.json'
+        self.done = []
+        self.times = {}
+
+    def order(self, done=[]):
+        """
+        Returns the ids of the steps not in done in the order they will run. At each point, of the steps whose
+        dependencies are done, picks one that does not leave dry air for ambient air, then the one needing the
+        smallest bias voltage change, then the earliest in the plan.
+        """
+
+        remaining = [step for step in self.steps.values() if step.id not in done]
+        finished = list(done)
+        air = 'dry' if any([self.steps[sid].air == 'dry' or self.steps[sid].action == 'dry_air' for sid in done]) else 'ambient'
+        bias = 0.
+
+        ordered = []
+        while len(remaining) > 0:
+            ready = [step for step in remaining if all([dep in finished for dep in step.after])]
+            if len(ready) == 0:
+                raise ValueError(f'steps {[step.id for step in remaining]} have circular dependencies')
+
+            ambient_left = any([step.air == 'ambient' for step in remaining])
+            def cost(step):
+                if step.air == 'ambient' and air == 'dry':
+                    aircost = 2
+                elif (step.air == 'dry' or step.action == 'dry_air') and air == 'ambient' and ambient_left:
+                    aircost = 1
+                else:
+                    aircost = 0
+                start, end = step.bias_range()
+                return (aircost, 0. if start is None else abs(start - bias), step.index)
+
+            step = min(ready, key=cost)
+            ordered.append(step.id)
+            finished.append(step.id)
+            remaining.remove(step)
+            if step.air == 'dry' or step.action == 'dry_air':
+                air = 'dry'
+            end = step.bias_range()[1]
+            if end is not None:
+                bias = end
+
+        return ordered
+
+    def _save(self):
+        """
+        Writes the checkpoint and keeps a copy of the current configuration file after the last completed step.
+        """
+
+        if self.state['-Debug-Mode-']:
+            return
+
+        config = None
+        if self.state['pc'] is not None and len(self.done) > 0:
+            config = f'{self.outdir}/sequence_{self.name}_{self.done[-1]}.yaml'
+            shutil.copy(self.state['pc'].config, config)
+
+        checkpoint = {'plan': self.name, 'module': self.state['-Module-Serial-'], 'updated': datetime.now().isoformat(),
+                      'done': self.done, 'times': self.times, 'config': config}
+        with open(self.checkpointpath + '.tmp', 'w') as file:
+            json.dump(checkpoint, file, indent=1)
+        os.replace(self.checkpointpath + '.tmp', self.checkpointpath)
+
+    def _resume(self):
+        """
+        Offers to resume from an unfinished checkpoint of this plan for this module, restoring the configuration
+        file saved with it.
+        """
+
+        if self.state['-Debug-Mode-'] or not os.path.isfile(self.checkpointpath):
+            return
+
+        with open(self.checkpointpath, 'r') as file:
+            checkpoint = json.load(file)
+
+        done = [sid for sid in checkpoint['done'] if sid in self.steps.keys()]
+        if checkpoint['module'] != self.state['-Module-Serial-'] or len(done) == 0 or len(done) == len(self.steps):
+            return
+
+        if self.state['operator'].resume(f"Resume {self.name} after {done[-1]}?") != 'RESUME':
+            return
+
+        self.done = done
+        self.times = checkpoint['times']
+        if checkpoint['config'] is not None and os.path.isfile(checkpoint['config']) and self.state['pc'] is not None:
+            shutil.copy(checkpoint['config'], self.state['pc'].config)
+            print(f' >> TestSequence: restored configuration from {checkpoint["config"]}')
+        print(f' >> TestSequence: resuming {self.name}, already done: {", ".join(self.done)}')
+
+    def _preconditions(self, step):
+        """
+        Checks and, where possible, establishes the preconditions of a step. Returns 'CONT' if the step can run.
+        """
+
+        state = self.state
+        requires = step.requires
+
+        if requires.get('services', False) and state['-Hexactrl-Accessed-']:
+            check_services(state)
+            if not (state['-DAQ-Server-'] and state['-I2C-Server-'] and state['-DAQ-Client-']):
+                print(f' -- TestSequence: services not running before {step.id}')
+                return 'END'
+
+        if requires.get('hv', None) == 'off' and state['-HV-Output-On-'] and not state['-Debug-Mode-']:
+            state['ps'].outputOff()
+            update_state(state, '-HV-Output-On-', False, 'black')
+
+        if 'rh_below' in requires.keys():
+            if not configuration['HasRHSensor'] or state['-Debug-Mode-']:
+                print(f' >> TestSequence: no RH sensor, not checking RH below {requires["rh_below"]}% before {step.id}')
+            else:
+                from AirControl import get_sampler
+                sampler = get_sampler()
+                timeout = 60*requires.get('rh_timeout', 30)
+                waiting = state['operator'].progress(f"Waiting for RH below {requires['rh_below']}% before {step.id}",
+                                                     title="Waiting for Dry Air", button='Stop Waiting')
+                start = time()
+                status = 'CONT'
+                while True:
+                    RH, Temp = sampler.latest()
+                    if RH is not None and RH < requires['rh_below']:
+                        break
+                    if time() - start > timeout:
+                        print(f' -- TestSequence: RH still {RH}% before {step.id} after {int(timeout)}s')
+                        status = 'END'
+                        break
+                    waiting.update(f'RH: {RH}% after {int(time() - start)}s, giving up after {int(timeout)}s')
+                    if waiting.wait(timeout=2.):
+                        print(f' >> TestSequence: stopped waiting for RH before {step.id} at operator request')
+                        status = 'TERM'
+                        break
+                waiting.close()
+                if status != 'CONT':
+                    return status
+
+        return 'CONT'
+
+    def run(self):
+        """
+        Runs the remaining steps in order. Stops at the first step which does not return 'CONT' and returns its status.
+        Prints the wall time of each step at the end.
+        """
+
+        self._resume()
+        order = self.order(self.done)
+        print(f' >> TestSequence: running {self.name}:', ' -> '.join(order))
+
+        status = 'CONT'
+        for sid in order:
+            step = self.steps[sid]
+            status = self._preconditions(step)
+            if status != 'CONT':
+                break
+
+            print(f' >> TestSequence: starting {sid} ({step.action})')
+            start = time()
+            status = actions[step.action](self.state, step)
+            self.times[sid] = round(time() - start, 1)
+            if status != 'CONT':
+                print(f' -- TestSequence: {sid} ended with {status}')
+                break
+
+            self.done.append(sid)
+            self._save()
+
+        print(f' >> TestSequence: {self.name} step times')
+        for sid in self.steps.keys():
+            if sid in self.times.keys():
+                print(f'     {sid:20s} {self.times[sid]:8.1f}s' + ('' if sid in self.done else ' (not completed)'))
+        return status
+
+def _live_bias(state, bias):
+    return bias if state['-Live-Module-'] else None
+
+def _trim(state, step):
+    return trim_pedestals(state, _live_bias(state, step.bias))
+
+def _pedestals(state, step):
+    if state['-Live-Module-'] and isinstance(step.bias, list):
+        BVs = step.bias
+    else:
+        BVs = [None for i in range(step.runs if step.runs is not None else len(step.bias))]
+    return multi_run_pedestals(state, BVs)
+
+def _iv(state, step):
+    status = take_IV_curve(state, step=step.stepV, maxV=step.maxV)
+    if status == 'CONT':
+        plot_IV_curves(state)
+    return status
+
+def _hv_off(state, step):
+    if state['-Live-Module-'] and not state['-Debug-Mode-']:
+        state['ps'].outputOff()
+        update_state(state, '-HV-Output-On-', False, 'black')
+    return 'CONT'
+
+def _dry_air(state, step):
+    open_dry_air(state)
+    return 'CONT'
+
+def _wait(state, step):
+    seconds = 60*step.minutes if not state['-Debug-Mode-'] else 1
+    return dry_wait(state, seconds, bias=_live_bias(state, step.bias))
+
+def _dry_until(state, step):
+    fallback = 60*step.minutes if not state['-Debug-Mode-'] else 1
+    timeout = 60*step.timeout if step.timeout is not None else None
+    return wait_for_dry(state, step.rh_below, timeout, fallback, bias=_live_bias(state, step.bias), hold=step.hold)
+
+actions = {'trim_pedestals': _trim, 'pedestals': _pedestals, 'iv': _iv, 'hv_off': _hv_off, 'dry_air': _dry_air, 'wait': _wait,
+           'dry_until': _dry_until}
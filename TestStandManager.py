@@ -0,0 +1,69 @@
+import threading
+import time
+
+from Configuration import configuration
+
+class TestStandManager:
+    """
+    Keeps a pool of connected FPGATestStand objects, one per hexacontroller, so that a test stand which is still
+    powered and running does not have to go through the full ssh connection, firmware load, and service startup
+    again when it is used for the next module.
+    """
+
+    def __init__(self, hostnames=configuration['FPGAHostname'], fpgatypes=configuration['FPGAType']):
+
+        self.fpgatypes = dict(zip(hostnames, fpgatypes))
+        self.stands = {}
+        self.health = {}
+        self._lock = threading.Lock()
+
+    def _healthy(self, ts):
+        """
+        Checks that a pooled test stand still answers over ssh and records the state of its services. A dropped
+        session is reopened by the test stand itself; returns False if the FPGA can no longer be reached at all.
+        """
+
+        try:
+            status = ts.probeservices()
+        except Exception:
+            return False
+
+        ts.services = all([unit['running'] for unit in status.values()])
+        self.health[ts.hostname] = {'time': time.time(), 'services': status}
+        return True
+
+    def connect(self, hostname, modulename, fpgatype=None):
+        """
+        Returns a test stand for the given hostname set up for the given module. A pooled test stand is reused if
+        its connection is still alive; otherwise a new FPGATestStand is created, which waits for the FPGA to boot
+        and may raise TimeoutError.
+        """
+
+        if fpgatype is None:
+            fpgatype = self.fpgatypes[hostname]
+
+        with self._lock:
+            ts = self.stands.get(hostname)
+
+        if ts is not None and ts.fpgatype == fpgatype and self._healthy(ts):
+            print(f' >> TestStandManager: reusing connection to {hostname}')
+            ts.set_module(modulename)
+            return ts
+
+        self.discard(hostname)
+        from FPGATestStand import FPGATestStand # imports paramiko, so only when a stand is first needed
+        ts = FPGATestStand(hostname, modulename, fpgatype=fpgatype)
+        with self._lock:
+            self.stands[hostname] = ts
+        return ts
+
+    def discard(self, hostname):
+        """
+        Removes a test stand from the pool and closes its connection, e.g. after the FPGA has been shut down.
+        """
+
+        with self._lock:
+            ts = self.stands.pop(hostname, None)
+            self.health.pop(hostname, None)
+        if ts is not None:
+            ts.ssh.close()
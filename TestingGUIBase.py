@@ -1,10 +1,10 @@
+from time import sleep, time, perf_counter
+startup = perf_counter()
 import sys
 import PySimpleGUI as sg
-from Keithley2410 import Keithley2410
-from time import sleep, time
 from InteractionGUI import *
-import yaml
-from datetime import datetime, timedelta
+from TestSequence import TestSequence
+from datetime import datetime
 
 """
 This script creates and runs the main GUI window for the testing system. It firsts establishes a theme and sets some functions, 
@@ -13,16 +13,8 @@ interaction with the layout.
 """
 
 # Load configuration file
-configuration = {}
-with open('configuration.yaml', 'r') as file:
-    configuration = yaml.safe_load(file)
-if 'FPGAHostname' not in configuration.keys() or 'FPGAType' not in configuration.keys():
-    configuration['FPGAHostname'] = configuration['TrenzHostname']
-    configuration['FPGAType'] = ['Trenz' for k in configuration['TrenzHostname']]
+from Configuration import configuration
 
-    
-from DBTools import add_RH_T, readout_info, iv_info, assembly_info, summary_upload
-    
 # Create theme
 lgfont = ('Arial', 40)
 sg.set_options(font=("Arial", int(configuration['DefaultFontSize'])))
@@ -53,14 +45,6 @@ def LEDIndicator(key=None, radius=30):
                     graph_top_right=(radius, radius),
                     pad=(0, 0), key=key, visible=True)
 
-def SetLED(window, key, color, empty=False):
-    graph = window[key]
-    graph.erase()
-    if not empty:
-        graph.draw_circle((0, 0), 12, fill_color=color, line_color=color)
-    else:
-        graph.draw_circle((0, 0), 12, fill_color=None, line_color=color)
-
 # Base window layouts
 # Module Setup fields for live modules only
 livemoduleonly = [[sg.Text('Sensor Thickness: '),
@@ -131,7 +115,7 @@ testsetup = [[sg.Text('Tests to run: ')],
               sg.Text('Bias Voltage: ', key='-Bias-Voltage-Other-Text-'), sg.Input(s=5, key='-Bias-Voltage-Other-')],
              [sg.Checkbox('Ambient IV Curve', key='-Ambient-IV-'), sg.Text(' Max V:'), sg.Input(s=5,key='-AmbIV-MaxV-')],
              [sg.Checkbox('Dry IV Curve', key='-Dry-IV-'), sg.Text('Number of tests: '), sg.Input(s=2, key='-N-Dry-IV-'), sg.Checkbox('800V Bias in Wait Period', key='-Dry-Wait-Bias-')],
-             [sg.Text('Wait Periods (minutes):'), sg.Input(s=3,key='-DryIV-Wait-Time-1-'), sg.Input(s=3,key='-DryIV-Wait-Time-2-'), sg.Input(s=3,key='-DryIV-Wait-Time-3-'),
+             [sg.Text('Wait Periods (minutes):'), sg.Input(s=3,key='-DryIV-Wait-Time-1-', tooltip='Leave blank to wait for the RH with an RH sensor'), sg.Input(s=3,key='-DryIV-Wait-Time-2-'), sg.Input(s=3,key='-DryIV-Wait-Time-3-'),
               sg.Text(' Max V:'), sg.Input(s=5,key='-DryIV-MaxV-')],
              [sg.Button("Run Tests", disabled=True, key='Run Tests'), sg.Button("Restart Services", disabled=True), sg.Text('', visible=False, key='-Display-Str-Right-')]]
 
@@ -175,7 +159,8 @@ layout = [[sg.Text("Module Testing GUI", font=lgfont, text_color=cmured)], logo,
           [sg.Frame('Status Bar', statusbar)]]
 
 # Create the window
-basewindow = sg.Window("Module Test: Start", layout, margins=(200,80), finalize=True, resizable=True, return_keyboard_events=True)
+title = "Module Test: Start" if configuration['StationName'] is None else f"Module Test: Start (Station {configuration['StationName']})"
+basewindow = sg.Window(title, layout, margins=(200,80), finalize=True, resizable=True, return_keyboard_events=True)
 # margins can be changed to suit the monitor; these are for a 1080p monitor
 basewindow['-EXPAND-'].expand(True, True, True) # expand space between menus and status bar
 event, values = basewindow.read(timeout=10)
@@ -185,9 +170,13 @@ basewindow.maximize()
 ledlist = ['-Debug-Mode-', '-Live-Module-', '-HV-Connected-', '-Box-Closed-', '-HV-Output-On-', '-DCDC-Connected-', '-DCDC-Powered-', '-Trophy-Connected-',
            '-Hexactrl-Connected-', '-Hexactrl-Powered-', '-Hexactrl-Accessed-', '-FW-Loaded-', '-DAQ-Server-', '-I2C-Server-', '-DAQ-Client-' ]
 
-for led in ledlist:
-    SetLED(basewindow, led, 'black', empty=True)
-SetLED(basewindow, '-Debug-Mode-', 'green' if DEBUG_MODE else 'red')
+leds = LEDBoard(basewindow, ledlist)
+leds.set('-Debug-Mode-', 'green' if DEBUG_MODE else 'red')
+
+# the heavy libraries are imported by the functions that need them; report any that are loaded before the window is up
+heavy = [lib for lib in ['numpy', 'matplotlib', 'pandas', 'uproot', 'asyncpg', 'paramiko', 'pyvisa', 'serial'] if lib in sys.modules]
+print(f' >> TestingGUIBase: window ready {round(perf_counter() - startup, 2)}s after start' +
+      (f'; loaded at startup: {", ".join(heavy)}' if len(heavy) > 0 else '') + ' (python3 -X importtime TestingGUIBase.py for details)')
     
 # Functions for enabling/disabling module setup fields
 def toggle_module_setup(enabled):
@@ -247,6 +236,14 @@ def exit_tests():
     if current_state['-Hexactrl-Accessed-']:
         check_services(current_state)
 
+    # Keep the box RH and T recorded by the sampler while these tests ran
+    tests_start = current_state.pop('tests_start', None)
+    if configuration['HasRHSensor'] and not current_state['-Debug-Mode-'] and tests_start is not None:
+        from AirControl import get_sampler
+        rhtpath = f'{configuration["DataLoc"]}/{current_state["-Output-Subdir-"]}/{current_state["-Module-Serial-"]}_RHT_{datetime.fromtimestamp(tests_start).strftime("%Y%m%d_%H%M%S")}.csv'
+        nsamples = get_sampler().save(rhtpath, since=tests_start)
+        print(f' >> TestingGUIBase: saved {nsamples} RH/T samples to {rhtpath}')
+
     # Reset test values
     clear_tests()
 
@@ -307,13 +304,16 @@ def init_state():
             current_state[led] = DEBUG_MODE
         else:
             current_state[led] = False
-            SetLED(basewindow, led, 'black')
+            leds.set(led, 'black')
 
     current_state.pop('-Pedestals-Trimmed-', None)
+    current_state.pop('dry_air_start', None)
     current_state['ts'] = None
     current_state['pc'] = None
     current_state['ps'] = None
+    current_state['interlock'] = None
     current_state['basewindow'] = basewindow
+    current_state['operator'] = WindowOperator(leds)
     current_state['-Module-Serial-'] = moduleserial
     current_state['-Inspector-'] = inspector
     current_state['-Module-Status-'] = modulestatus
@@ -323,7 +323,7 @@ def update_state(state, field, val, color=None):
     state[field] = val
     if field[0] == '-':
         assert color is not None
-        SetLED(basewindow, field, color)
+        leds.set(field, color)
 
 def show_string(string, field='Left'):
     basewindow[f'-Display-Str-{field}-'].update(string)
@@ -352,7 +352,7 @@ while True:
     event, values = basewindow.read()
     basewindow.maximize() # Fullscreen
    
-    SetLED(basewindow, '-Debug-Mode-', 'green' if values['-DEBUG-MODE-'] else 'red')
+    leds.set('-Debug-Mode-', 'green' if values['-DEBUG-MODE-'] else 'red')
     DEBUG_MODE = values['-DEBUG-MODE-']        
 
     # Set and show module serial number via QR code scanner
@@ -482,11 +482,11 @@ while True:
     # Check if live module
     if values['-IsLive-']:
         majortype[0] = 'M'
-        SetLED(basewindow, '-Live-Module-', 'green')
+        leds.set('-Live-Module-', 'green')
         livemodule = True
     if values['-IsHB-']:
         majortype[0] = 'X'
-        SetLED(basewindow, '-Live-Module-', 'black')
+        leds.set('-Live-Module-', 'black')
         livemodule = False
         
     # Change visibility of sections based on if live module or not
@@ -741,10 +741,14 @@ while True:
         # the power supply object, and handles errors as well.
         outcode = check_leakage_current(current_state)
                     
+        if outcode == 'CONT' and close_box(current_state) != 'CONT':
+            # the user stopped waiting for the box to be closed
+            end_session(current_state)
+            outcode = 'END'
+
         if outcode == 'CONT':
 
             # If there are no issues, enable the IV tests
-            close_box(current_state)
             enable_iv_tests()
             basewindow['Run Tests'].update(disabled=False)
             basewindow['End Session'].update(disabled=False)
@@ -766,8 +770,8 @@ while True:
 
         # if controlling box air automatically, turn off
         if configuration['HasRHSensor'] and not current_state['-Debug-Mode-']:
-            from AirControl import AirControl
-            ac = AirControl()
+            from AirControl import get_sampler
+            ac = get_sampler().controller
             for i in range(10):
                 ac.set_air_off()
         
@@ -816,6 +820,7 @@ while True:
         else:
             current_state['-Output-Subdir-'] = f'{moduleserial}/{status}_{date}'
         print(f' >> TestingGUIBase: will send test output to {current_state["-Output-Subdir-"]}')
+        current_state['tests_start'] = time()
 
         if 'pc' in current_state.keys():
             if current_state['pc'] is not None:
@@ -840,85 +845,21 @@ while True:
 
         # add RH, T to state dict now
         # values also modified at the start of an IV curve
+        from DBTools import add_RH_T
         RH, Temp = add_RH_T(current_state)
 
-        # Standard test sequence links together lots of tests
+        # Standard test sequence links together lots of tests, see test_plans/
         if values['-Standard-Test-']:
 
-            # for hexaboards, just take a bunch of pedestals, then skip the rest
-            if not values['-IsLive-']:
-                #multi_run_pedestals(current_state, [None, None])
-                status = trim_pedestals(current_state, None)
-                if status == 'CONT':
-                    status = multi_run_pedestals(current_state, [None, None, None, None, None, None])
-                exit_tests()
-                continue
-            
-            # trim and take pedestals
-            status = trim_pedestals(current_state, 300)
-            if status == 'CONT':
-                status = multi_run_pedestals(current_state, [10, 300, 300, 300, 300, 300, 800, 800])
-
-            current_state['ps'].outputOff()
-            update_state(current_state, '-HV-Output-On-', False, 'black')
-
-            if status != 'CONT':
-                exit_tests()
-                continue
-            
-            # take ambient IV curve - do we want?
-            status = take_IV_curve(current_state)
-            if status != 'CONT':
-                exit_tests()
-                continue
-            plot_IV_curves(current_state)
-            
-            # open dry air valve manually or automatically            
-            if not configuration['HasRHSensor'] or current_state['-Debug-Mode-']:
-                from InteractionGUI import do_something_window
-                do_something_window('Open dry air valve', 'Open')
-            else:
-                from AirControl import AirControl
-                ac = AirControl()
-                for i in range(10):
-                    ac.set_air_on()
-                    
-            # bias at 800V during wait to improve curve consistency for modules with glue on guard ring
-            current_state['ps'].outputOn()
-            update_state(current_state, '-HV-Output-On-', True, 'Green')
-            current_state['ps'].setVoltage(800.)
-
-            wait_time_s = 20*60 # 20 min    
-            dry_date = datetime.now()
-            finalIV_date = dry_date + timedelta(seconds=wait_time_s)
-            finalIV_time = finalIV_date.isoformat().split('T')[1].split('.')[0]
-
-            layout = [[sg.Text(f"Waiting until {finalIV_time} to perform IV", font=lgfont)],
-                      [sg.Button('Terminate Test')]]
-            waiting = sg.Window(f"Module Test: Waitinf for Dry IV", layout, margins=(200,100))
-
-            event, values = waiting.read(timeout=100)
+            plan = 'test_plans/standard_live.yaml' if values['-IsLive-'] else 'test_plans/standard_hexaboard.yaml'
+            if values['-IsLive-'] and 'StandardTestPipelined' in configuration.keys() and configuration['StandardTestPipelined']:
+                plan = 'test_plans/standard_live_pipelined.yaml'
+            status = TestSequence(plan, current_state).run()
 
-            print(f' >> TestingGUIBase: waiting until {finalIV_time} to perform IV')
-
-            while True:
-                event, values = waiting.read(timeout=1)
-                if event == 'Terminate Test' or event == sg.WIN_CLOSED:
-                    print(' >> TestingGUIBase: calling TERMINATE while waiting for dry IV at user request')
-                    status = 'TERM'
-                    break
-                if datetime.now() >= finalIV_date:
-                    break
-
-            if status != 'CONT':
-                exit_tests()
-                continue
-
-            status = take_IV_curve(current_state)
-            if status != 'CONT':
+            # for hexaboards, just take a bunch of pedestals, then skip the rest
+            if status != 'CONT' or not values['-IsLive-']:
                 exit_tests()
                 continue
-            plot_IV_curves(current_state)
             
         # For trimming pedestals, check to make sure bias voltage is entered if needed and then run
         if values['-Trim-Pedestals-']:
@@ -1008,19 +949,16 @@ while True:
         if values['-Dry-IV-']:
 
             # open dry air valve manually or automatically
-            if not configuration['HasRHSensor'] or current_state['-Debug-Mode-']:
-                from InteractionGUI import do_something_window
-                do_something_window('Open dry air valve', 'Open')
-            else:
-                from AirControl import AirControl
-                ac = AirControl()
-                for i in range(10):
-                    ac.set_air_on()
-                            
+            open_dry_air(current_state)
+
             for iV in range(int(values['-N-Dry-IV-'])):
 
                 thiswait = values[f'-DryIV-Wait-Time-{iV+1}-']
 
+                # with an RH sensor, a first curve without a wait time starts once the box is dry rather than after a
+                # fixed time; a wait time entered by the operator is always kept
+                rhwait = iV == 0 and thiswait == '' and configuration['HasRHSensor'] and not current_state['-Debug-Mode-']
+
                 if thiswait == '':
                     time_to_wait = 15. if not current_state['-Debug-Mode-'] else 0.5
                 elif thiswait == '0':
@@ -1029,56 +967,35 @@ while True:
                     time_to_wait = float(thiswait)
                 final_dry_time = 60*(time_to_wait)
 
-                sleep(1)
-                
-                drytime = time()
-                dry_date = datetime.now()
-                finalIV_date = dry_date + timedelta(seconds=final_dry_time)
-                finalIV_time = finalIV_date.isoformat().split('T')[1].split('.')[0]
-                time_to_wait = final_dry_time - (time() - drytime)
-                
-                # Wait until time passed, then run dry IV curve
-                layout = [[sg.Text(f"Waiting until {finalIV_time} to perform IV", font=lgfont)],
-                          [sg.Button('Terminate Test')]]
-                waiting = sg.Window(f"Module Test: Waitinf for Dry IV", layout, margins=(200,100))
-
-                event, values = waiting.read(timeout=100)
-                print(f' >> TestingGUIBase: waiting until {finalIV_time} to perform IV')
-
                 # module conditioning
-                if current_state['-Live-Module-'] and not current_state['-Debug-Mode-'] and time_to_wait > 10:
+                bias = None
+                if current_state['-Live-Module-'] and not current_state['-Debug-Mode-'] and (rhwait or final_dry_time > 10):
                     if values['-Dry-Wait-Bias-']:
-                        current_state['ps'].outputOn()
-                        update_state(current_state, '-HV-Output-On-', True, 'Green')
-                        current_state['ps'].setVoltage(800.)
+                        bias = 800.
                     else:
                         current_state['ps'].outputOff()
                         update_state(current_state, '-HV-Output-On-', False, 'black')
-                
-                while True:
-                    event, values = waiting.read(timeout=1)
-                    if event == 'Terminate Test' or event == sg.WIN_CLOSED:
-                        print(' >> TestingGUIBase: calling TERMINATE while waiting for dry IV at user request')
-                        status = 'TERM'
-                        break
-                    if datetime.now() >= finalIV_date:
-                        break
+
+                if rhwait:
+                    status = wait_for_dry(current_state, bias=bias)
+                else:
+                    status = dry_wait(current_state, final_dry_time, bias=bias)
 
                 if current_state['-Live-Module-'] and not current_state['-Debug-Mode-']:
                     current_state['ps'].setVoltage(0.)
 
-                waiting.close()
-
                 if status != 'CONT':
-                    exit_tests()
-                    continue
+                    break
 
                 status = take_IV_curve(current_state)
                 if status == 'CONT':
                     plot_IV_curves(current_state)
                 else:
-                    exit_tests()
-                    continue
+                    break
+
+            if status != 'CONT':
+                exit_tests()
+                continue
 
         # check service status, clear test values, turn off HV, reset buttons        
         exit_tests()
@@ -1107,6 +1024,7 @@ while True:
             continue
 
         print(f' >> TestingGUIBase: Grading {moduleserial}')
+        from DBTools import readout_info, iv_info, assembly_info, summary_upload
         try:
             unconcells, deadcells, noisycells, groundedcells, badcell, badfrac = readout_info(moduleserial)
             i_600v, i_850v = iv_info(moduleserial)
@@ -1187,6 +1105,11 @@ while True:
         qc_summary = grade_module_window(moduleserial, qc_summary)
         summary_upload(moduleserial, qc_summary)
         
+    # the interlock monitor saw the dark box lid move while no step was waiting on it
+    if event == '-Lid-Changed-' and current_state['interlock'] is not None:
+        closed = values['-Lid-Changed-']
+        update_state(current_state, '-Box-Closed-', closed, 'green' if closed else 'black')
+
     # This shouldn't ever happen. To kill the window, kill it from the terminal window where you ran it
     # or press the 'Close GUI' button.
     if event == sg.WIN_CLOSED:
@@ -0,0 +1,185 @@
+import os
+import sys
+import json
+import threading
+from time import time, perf_counter
+from datetime import datetime
+
+from Configuration import configuration
+
+"""
+-------------------Timing.py-----------------
+
+Records where the time of a testing session goes. Each phase worth timing is wrapped in a span:
+
+    with span('loadfw', hostname=self.hostname) as timing:
+        ...
+        timing.set(reused=True)
+
+When the block ends, one JSON line is appended to the session's trace, DataLoc/timing/<start>[_<station>].jsonl, with
+the span's name, its start (unix time), its duration in seconds, whether it ended without an exception, the span it is
+nested in (in the same thread), the station, the thread, and the attributes given. The first span of a session starts
+the trace; TestCore.end_session prints the summary table of the session and ends it.
+
+Traces of several sessions or stations are summarised together with
+
+    python3 Timing.py DataLoc/timing/*.jsonl
+-----------------------------------------------------
+"""
+
+class Trace:
+    """
+    The spans of one session, kept in memory for the summary and appended to the trace file as they end. If the file
+    can't be written (e.g. no DataLoc on a debugging machine), the spans are only kept in memory.
+    """
+
+    def __init__(self):
+
+        self.start = time()
+        self.records = []
+        self._lock = threading.Lock()
+
+        station = configuration['StationName']
+        label = datetime.fromtimestamp(self.start).strftime('%Y%m%d_%H%M%S') + (f'_{station}' if station is not None else '')
+        self.path = f'{configuration["DataLoc"]}/timing/{label}.jsonl'
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self._file = open(self.path, 'a', buffering=1)
+        except OSError as e:
+            print(f' -- Timing: cannot write {self.path} ({e}), keeping spans in memory only')
+            self._file = None
+            self.path = None
+
+    def add(self, record):
+        """Adds the record of an ended span, also after the trace was closed (e.g. a span around end_session)
+        """
+        line = json.dumps(record, default=str) + '\n'
+        with self._lock:
+            self.records.append(record)
+            if self._file is not None:
+                self._file.write(line)
+            elif self.path is not None:
+                with open(self.path, 'a') as file:
+                    file.write(line)
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+_trace = None
+_trace_lock = threading.Lock()
+_local = threading.local()
+
+def current_trace():
+    """Returns the trace of the current session, starting one if there is none
+    """
+    global _trace
+    with _trace_lock:
+        if _trace is None:
+            _trace = Trace()
+        return _trace
+
+def end_trace():
+    """
+    Closes the trace of the current session and returns it (None if no span was recorded). The next span starts a new
+    trace.
+    """
+
+    global _trace
+    with _trace_lock:
+        trace, _trace = _trace, None
+    if trace is not None:
+        trace.close()
+    return trace
+
+class Span:
+    """
+    Times the block it wraps; see span().
+    """
+
+    def __init__(self, name, attrs):
+
+        self.name = name
+        self.attrs = attrs
+        self.parent = None
+        self.start = None
+        self.seconds = None
+
+    def set(self, **attrs):
+        """Adds attributes to the record of the span, e.g. results only known at the end of the block
+        """
+        self.attrs.update(attrs)
+
+    def __enter__(self):
+
+        if not hasattr(_local, 'stack'):
+            _local.stack = []
+        if len(_local.stack) > 0:
+            self.parent = _local.stack[-1].name
+        _local.stack.append(self)
+        self.trace = current_trace()
+        self.start = time()
+        self._begin = perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+
+        self.seconds = perf_counter() - self._begin
+        _local.stack.remove(self)
+        record = {'span': self.name, 'start': round(self.start, 3), 'seconds': round(self.seconds, 4), 'ok': exc_type is None,
+                  'parent': self.parent, 'station': configuration['StationName'], 'thread': threading.current_thread().name}
+        record.update(self.attrs)
+        self.trace.add(record)
+        return False # exceptions go on to the caller
+
+def span(name, **attrs):
+    """Returns a context manager which records the block it wraps as the span name with the given attributes
+    """
+    return Span(name, attrs)
+
+def summarize(records):
+    """
+    Returns a list of (name, count, total seconds, mean seconds, max seconds) for the span names in records, the
+    longest total first.
+    """
+
+    durations = {}
+    for record in records:
+        durations.setdefault(record['span'], []).append(record['seconds'])
+    rows = [(name, len(times), sum(times), sum(times)/len(times), max(times)) for name, times in durations.items()]
+    rows.sort(key=lambda row: -row[2])
+    return rows
+
+def print_summary(records, wall, title):
+    """
+    Prints the summary table of records. The share of each span is of wall seconds; nested spans are also counted in
+    the span around them, so the shares can add up to more than 100%.
+    """
+
+    print(f' >> Timing: {title}, {round(wall/60., 1)} min, {len(records)} spans')
+    print(f'     {"span":24s} {"count":>6s} {"total":>10s} {"mean":>9s} {"max":>9s} {"share":>6s}')
+    for name, count, total, mean, longest in summarize(records):
+        share = 100*total/wall if wall > 0 else 0.
+        print(f'     {name:24s} {count:6d} {total:9.1f}s {mean:8.2f}s {longest:8.2f}s {share:5.1f}%')
+
+def session_summary(trace):
+    """Prints the summary table of an ended session's trace
+    """
+    if trace is None:
+        return
+    print_summary(trace.records, time() - trace.start, 'session' + (f' ({trace.path})' if trace.path is not None else ''))
+
+if __name__ == '__main__':
+
+    records = []
+    wall = 0.
+    for path in sys.argv[1:]:
+        with open(path, 'r') as file:
+            session = [json.loads(line) for line in file if line.strip() != '']
+        if len(session) == 0:
+            continue
+        records += session
+        wall += max([r['start'] + r['seconds'] for r in session]) - min([r['start'] for r in session])
+    print_summary(records, wall, f'{len(sys.argv[1:])} traces')
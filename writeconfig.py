@@ -4,6 +4,7 @@ config_dict = {'DebugMode': True,
                'DefaultFontSize': '15', # 15 works well for 1920x1080 screens
                'TestingPCOpSys': 'Centos7', # or 'Alma9'
                'HexactrlSWBranch': 'ROCv3', # gitlab branch of `hexactrl-sw`, should be 'ROCv3' for most. If you updated to Alma 9 some time ago (but not recently), use 'feature-alma9' instead.
+               'HexactrlWorker': False, # launch testing scripts from one long-lived process in the hexactrl environment, see ScriptWorker.py
                'FPGAHostname': ['cmshgcaltb4.lan.local.cmu.edu', 'cmshgcalkria1.lan.local.cmu.edu'], # renamed Trenz->FPGA
                'FPGAType': ['Trenz', 'Kria'], # type of FPGA; order __must__ match 'FPGAHostname'
                'MACSerial': 'CM',
@@ -12,9 +13,18 @@ config_dict = {'DebugMode': True,
                'HVDiscoveryMode': 'by-resource', # if you use something like the above; use 'by-id' if instead of the /dev/ location you use the link shown by `ls -l /dev/serial/by-id`
                'HVTerminal': 'Rear', # 'Front' for front terminals, 'Rear' for rear terminals
                'HVWiresPolarization': 'Reverse', # 'Reverse' for reverse bias (V in [0, 800]) 'Forward' for forward bias (V in [-800, 0])
+               'HVBinaryTransfer': False, # transfer Keithley readings as binary floats instead of ASCII; faster over RS232, but not yet verified on the hardware, so keep false until then
                'PCKeyLoc': '/home/hgcal/.ssh/id_rsa', # private key location
                'HasHVSwitch': True, # switch on the box which only allows HV when switch is triggered
+               'HVSwitchPollInterval': 1., # seconds between reads of the box switch by the interlock monitor
                'HasRHSensor': False, # automatic sensing of RH and T inside test box, see AirControl.py. You may want to re-implement it.
+               'AirControlSerialID': 'usb-FTDI_FT232R_USB_UART_AC0090JP-if00-port', # with an RH sensor, the Arduino of the sensor and air relay as listed by `ls -l /dev/serial/by-id`
+               'DryRHThreshold': 5, # with an RH sensor, dry IV curves start once the RH (%) stays below this...
+               'DryRHHold': 60, # ...for this many seconds...
+               'DryRHTimeout': 30, # ...giving up after this many minutes
+               'StandardTestPipelined': False, # dry the box during the pedestal runs of the standard test, see test_plans/standard_live_pipelined.yaml
+               'DAQClientService': 'daq-client', # systemd service of the DAQ client on the testing PC
+               'Stations': {}, # optional: per-station overrides for testing several modules at once, see Station.py
                'Inspectors': ['acrobert', 'simurthy', 'jestein', 'ppalit', 'akallilt'], # CERN usernames
                'HasLocalDB': True,
                # these four only if you have a local database